@@ -1,9 +1,8 @@
 
 # Importing the necessary libraries
-from shiny import render, reactive
-from shiny.express import input, ui
+from shiny import render, reactive, req
+from shiny.express import input, ui, session
 from matplotlib import pyplot as plt
-from outputs.export_doc import generate_docx
 
 # importing functions from the notebook ---Remove when moving to .py file
 # from importnb import Notebook
@@ -12,12 +11,22 @@ import sys
 import os
 import ast
 import json
+import asyncio
+import time
+import tempfile
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from parser.parser import process_dxf
 from calcs.calc_cable_size import table_data
-from kernel import ground_grid
-from plots.plots import plot_grid_with_lines_and_rods
+from kernel import STAGES
+from GUI.background import run_ground_grid, prefetch_drawing, BackgroundRun, stats as calculation_stats
+from GUI.upload_cache import upload_cache
+from outputs.format_results import format_results, SUMMARY_KEYS, STATUS_KEYS
+from plots.plots import grid_png, png_cache_info
+from instrumentation import enable_from_environment, stage, timed
+
+# Set GROUNDING_TIMINGS=timings.json to record how long every handler and stage takes
+_recorder = enable_from_environment()
 
 # Extract conductor types (first column of table_data)
 conductor_types = {row[0]: row[0] for row in table_data}
@@ -72,6 +81,19 @@ with ui.sidebar(title="Main Inputs"):
         "DXF Drawing Units",
         {"m":"m","mm":"mm", "in":"in"},	
         )
+
+    # The drawing is read as soon as it is uploaded, while the other inputs are filled in
+    @render.text
+    def prefetch_status():
+        status = prefetch_task.status()
+        if status == "running":
+            return "Reading the drawing..."
+        if status != "success":
+            return ""
+        entry, seconds = prefetch_task.result()
+        geometry = entry.geometry
+        return (f"{entry.name}: {len(entry.lines)} segments, {len(entry.rods)} rods, "
+                f"{geometry.shape} shape of {geometry.area:.0f} m², ready in {seconds:.1f} s")
     
 
     ui.input_text("Soil_Resistivity","Soil Resistivity (ohm-m)", value=100)
@@ -113,41 +135,35 @@ with ui.layout_column_wrap(width=1/2):
         # @reactive.event(input.Calculate, input.DXF_file)
         def download_results():
             # Proceed with generating the file for download
-            a, b, c = Calc_results()
-            
-            if a is None and b is None and c is None:
-                a={"No results available": "No results available"}
-                b={"No results available": "No results available"}
-                c={"No results available": "No results available"}
-                
-            df1, df2 = results_to_pd(a, b)
-            path = generate_docx(df1, df2, c, filename="results.docx")
+            # python-docx is only needed for the report
+            from outputs.export_doc import generate_docx
+
+            # Without a DXF file the tables are empty and the document says so
+            with stage("download_results", "gui"):
+                a, b, c = Calc_results()
+                df1, df2 = results_to_pd(a, b)
+                path = generate_docx(df1, df2, c, filename="results.docx")
             with open(path, "rb") as f:
                 yield f.read()
 
         @render.ui
-        @reactive.event(input.Calculate, input.DXF_file, input.Units, ignore_init=False)
         def showing_results_markdown():
             if not input.DXF_file():
                 return ui.markdown("""No DXF file uploaded\nPlease upload a file to view results.""")
             else:
                 resultsx, _, _ = Calc_results()
                 if resultsx:
-                    last_two_entries = list(resultsx.items())[-3:]
-                    compliance= last_two_entries[0][1]
-                    first_entry=last_two_entries[1]
-                    second_entry=last_two_entries[2]
-
-                    # Format the first entry for display
-                    if compliance is False:
-                        # Print first_entry in red if compliance is False
-                        formatted_result2 = f'<span style="color: red; font-weight: bold;">**{second_entry[0]}:** {second_entry[1]}</span>'
+                    formatted = format_results(resultsx)
+                    touch_entry = f"**Touch Status:** {formatted['Touch Status']}"
+                    step_entry = f"**Step Status:** {formatted['Step Status']}"
+
+                    # Show the touch status in red if the grid is not compliant
+                    if not resultsx.compliant:
+                        formatted_result2 = f'<span style="color: red; font-weight: bold;">{touch_entry}</span>'
                     else:
-                        # Print first_entry normally if compliance is True
-                        formatted_result2 = f"**{second_entry[0]}:** {second_entry[1]}"
-                    formatted_result1 = f"**{first_entry[0]}:** {first_entry[1]}"
+                        formatted_result2 = touch_entry
+                    formatted_result1 = step_entry
 
-                    
                     # Return the formatted result as Markdown
                     return ui.markdown(f"### Result \n{formatted_result2} <br> {formatted_result1}")
                 else:
@@ -160,29 +176,6 @@ with ui.layout_column_wrap(width=1/2):
         with ui.layout_column_wrap(width=1/2):  # Use column wrap to display cards in parallel
             with ui.card(title="Results1", full_screen=False, width=1/4, height="400px"):
                 @render.data_frame
-                @reactive.event(
-                    input.Calculate,
-                    input.DXF_file,
-                    input.Units,
-                    input.Soil_Resistivity,
-                    input.Crushed_rock_resistivity,
-                    input.Crushed_rock_depth,
-                    input.Conductor_Type,
-                    input.Short_Circuit_Sizing,
-                    input.Short_Circuit,
-                    input.Split_Factor,
-                    input.Fault_duration,
-                    input.Person_Weight,
-                    input.Depth,
-                    input.Rod_lenght,
-                    input.Rod_diameter,
-                    input.Advanced_Options,
-                    input.Rpt_model,
-                    input.Ambient_temp,
-                    input.OverrideMesh,
-                    input.Parallel_Separ,
-                    ignore_init=True,
-                )
                 def showing_results1():
                     resultsx,filepath,_= Calc_results()
                     results1,_=results_to_pd(resultsx, filepath)
@@ -190,58 +183,59 @@ with ui.layout_column_wrap(width=1/2):
 
             with ui.card(title="Results2", full_screen=False, width=1/4, height="400px"):
                 @render.data_frame
-                @reactive.event(
-                    input.Calculate,
-                    input.DXF_file,
-                    input.Units,
-                    input.Soil_Resistivity,
-                    input.Crushed_rock_resistivity,
-                    input.Crushed_rock_depth,
-                    input.Conductor_Type,
-                    input.Short_Circuit_Sizing,
-                    input.Short_Circuit,
-                    input.Split_Factor,
-                    input.Fault_duration,
-                    input.Person_Weight,
-                    input.Depth,
-                    input.Rod_lenght,
-                    input.Rod_diameter,
-                    input.Advanced_Options,
-                    input.Rpt_model,
-                    input.Ambient_temp,
-                    input.OverrideMesh,
-                    input.Parallel_Separ,
-                    ignore_init=True,
-                )
                 def showing_results2():
                     resultsx,filepath,_= Calc_results()
                     _,results2=results_to_pd(resultsx, filepath)
-                    # Exclude the last entry of results2
-                    results2 = results2.iloc[:-1]  # Remove the last row
+                    if not results2.empty:
+                        results2 = results2[results2["Parameter"] != "Compliance"]  # Remove the compliance flag
                     return results2
 
 
 with ui.card(full_screen=False, fill=True):
-    @render.plot
-    @reactive.event(input.Calculate, input.DXF_file, input.Units)
+    @render.image(delete_file=True)
+    @timed(category="gui")
     def render_plot_grid():
         print(f"DXF File Input: {input.DXF_file()}")
 
-        if not input.DXF_file():
+        upload = dxf_upload()
+        if upload is None:
             print("No file uploaded.")
             return None
-        
-        filepath = input.DXF_file()[0]["datapath"] if input.DXF_file() else None  # Path to the uploaded DXF file
-        fileunits = input.Units()  # DXF Drawing Units
-        print(f"File Units: {fileunits}")
 
-        if not filepath:
-            return None
-        
-        fig = plot_grid_with_lines_and_rods(filepath, fileunits)            
+        _, fileunits = upload  # Drawing units of the uploaded DXF file
+        print(f"File Units: {fileunits}")
 
-        return fig
+        # The arrays come from the prefetched drawing, and the image is rendered once per
+        # geometry and size for all the sessions
+        entry, _ = prefetch_task.result()
+        width = int(session.clientdata.output_width() or 800)
+        height = int(session.clientdata.output_height() or 400)
+        ratio = session.clientdata.pixelratio()
+        png = grid_png(entry.lines, entry.rods, width * ratio, height * ratio, dpi=96 * ratio)
+        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as f:
+            f.write(png)
+        return {"src": f.name, "width": f"{width}px", "height": f"{height}px"}
     
+# Server cache statistics, set GROUNDING_ADMIN=1 to show them
+if os.environ.get("GROUNDING_ADMIN"):
+    with ui.card(full_screen=True):
+        ui.card_header("Server cache")
+
+        @render.data_frame
+        def cache_totals():
+            reactive.invalidate_later(5)
+            totals, _ = upload_cache.stats()
+            totals.update({f"calculations {key}": value for key, value in calculation_stats.items()})
+            totals.update({f"previews {key}": value for key, value in png_cache_info().items()})
+            return pd.DataFrame([{"Parameter": key, "Value": f"{value:.2f}" if isinstance(value, float) else str(value)}
+                                 for key, value in totals.items()])
+
+        @render.data_frame
+        def cache_entries():
+            reactive.invalidate_later(5)
+            _, entries = upload_cache.stats()
+            return pd.DataFrame(entries).round(2)
+
 # TODO Later ###Input additional rods and cables    
     # ui.input_switch("Add_cable", "Add Cable", app_state["add_cable"])
     # with ui.panel_conditional("input.Add_cable"):
@@ -281,69 +275,207 @@ def units():
 
 
 
-# Functions definitions
+# One calculation shared by every output
 
-def Calc_results():
-    filepath = input.DXF_file()[0]["datapath"] if input.DXF_file() else None  # Path to the uploaded DXF file
-    fileunits = input.Units()  # DXF Drawing Units
-    conductor_type = input.Conductor_Type()  # Conductor Type
-    short_circuit_conductor = float(input.Short_Circuit_Sizing())  # Short Circuit Current for the conductor (kA)
-    short_circuit = float(input.Short_Circuit())   # Short circuit (kA)
-    fault_duration = float(input.Fault_duration())  # Fault Duration (seconds)
-    person_weight = float(input.Person_Weight())  # Person Weight (kg)
-    cable_depth = float(input.Depth())  # Burying Depth (meters)
-    depth_crushed_rock = float(input.Crushed_rock_depth())  # Crushed Rock Depth (meters)
-    ro = float(input.Soil_Resistivity())  # Soil Resistivity (Ohm-m)
-    ros = float(input.Crushed_rock_resistivity())  # Crushed Rock Resistivity (Ohm-m)
-    ambient_temperature = 40  # Ambient Temperature (Celsius) - hardcoded as per the example
-    split_factor = float(input.Split_Factor())  # Split Factor
-    rod_length = float(input.Rod_lenght())  # Rod Length (meters)
-    rod_diameter = float(input.Rod_diameter())  # Rod Diameter (meters)
-    case = input.Rpt_model() if input.Advanced_Options() else "Sverak"  # Grounding Resistance Model
-    override_mesh=input.OverrideMesh()    #Input override Mesh
-    parallel_separ=float(input.Parallel_Separ()) #advanced options to define D
+# Kernel runs of this session (the app runs once per session), printed after every
+# interaction: an input change should cost a single run. The runs avoided are the
+# input changes followed by another one within DEBOUNCE_SECONDS ("debounced") and
+# the requests for the inputs of the current results ("unchanged").
+kernel_runs = {"interactions": 0, "pending": 0, "total": 0, "cancelled": 0, "recomputed": None,
+               "debounced": 0, "unchanged": 0}
 
-    # Ensure filepath is provided
-    if not filepath:
-        results={}
-        return results, filepath, None
-    
-    inputs_collection=(filepath, fileunits, conductor_type, short_circuit_conductor, short_circuit, fault_duration, person_weight,cable_depth, depth_crushed_rock, ro, ros, ambient_temperature, split_factor, rod_length,rod_diameter,case, override_mesh, parallel_separ)
-    inputs_dict = {
-    "Filepath": inputs_collection[0],
-    "DXF Drawing Units": inputs_collection[1],
-    "Conductor Type": inputs_collection[2],
-    "Conductor Short Circuit": f"{inputs_collection[3]} kA",
-    "Short Circuit Current": f"{inputs_collection[4]} kA",
-    "Fault Duration": f"{inputs_collection[5]} seconds",
-    "Person Weight": f"{inputs_collection[6]} kg",
-    "Split Factor": inputs_collection[12],
-    "Soil Resistivity": f"{inputs_collection[9]} Ohm-m",
-    "Crushed Rock Resistivity": f"{inputs_collection[10]} Ohm-m",
-    "Crushed Rock Depth": f"{inputs_collection[8]} meters",
-    "Conductors Depth": f"{inputs_collection[7]} meters",
-    "Rods Length": f"{inputs_collection[13]} meters",
-    "Rods Diameter": f"{inputs_collection[14]} meters",
-    "Ambient Temperature": f"{inputs_collection[11]} °C",
-    "Grounding Resistance Model": inputs_collection[15],
-    "Override Drawing Mesh": inputs_collection[16],
-    "Mesh Size": inputs_collection[17]
-    }
+# Quiet time after an input change before the calculation starts
+DEBOUNCE_SECONDS = 0.4
+
+@reactive.calc
+def dxf_upload():
+    """
+    Path and units of the uploaded drawing, None without a file.
+    """
+    if not input.DXF_file():
+        return None
+    return input.DXF_file()[0]["datapath"], input.Units()
+
+@reactive.extended_task
+async def prefetch_task(filepath, fileunits, name):
+    """
+    Parse and geometry analysis of the uploaded drawing, started on upload.
+    """
+    start = time.perf_counter()
+    entry = await prefetch_drawing(filepath, fileunits, name)
+    return entry, time.perf_counter() - start
 
-    # Call the ground_grid function
-    results = ground_grid(
-        filepath, fileunits, conductor_type, short_circuit_conductor, short_circuit,
-        fault_duration, person_weight, cable_depth, depth_crushed_rock, ro, ros,
-        ambient_temperature, split_factor, rod_length, rod_diameter, case, override_mesh, parallel_separ
+@reactive.effect
+def prefetch_upload():
+    upload = dxf_upload()
+    prefetch_task.cancel()
+    if upload is not None:
+        prefetch_task.invoke(*upload, input.DXF_file()[0]["name"])
+
+@reactive.calc
+def calc_inputs():
+    """
+    Arguments of ground_grid taken from the inputs, None without a DXF file.
+    """
+    upload = dxf_upload()
+
+    # Ensure filepath is provided
+    if upload is None:
+        return None
+
+    filepath, fileunits = upload  # Path to the uploaded DXF file and drawing units
+    return dict(
+        filepath=filepath,
+        fileunits=fileunits,
+        conductor_type=input.Conductor_Type(),  # Conductor Type
+        short_circuit_conductor=float(input.Short_Circuit_Sizing()),  # Short Circuit Current for the conductor (kA)
+        short_circuit=float(input.Short_Circuit()),  # Short circuit (kA)
+        fault_duration=float(input.Fault_duration()),  # Fault Duration (seconds)
+        person_weight=float(input.Person_Weight()),  # Person Weight (kg)
+        cable_depth=float(input.Depth()),  # Burying Depth (meters)
+        depth_crushed_rock=float(input.Crushed_rock_depth()),  # Crushed Rock Depth (meters)
+        ro=float(input.Soil_Resistivity()),  # Soil Resistivity (Ohm-m)
+        ros=float(input.Crushed_rock_resistivity()),  # Crushed Rock Resistivity (Ohm-m)
+        ambient_temperature=40,  # Ambient Temperature (Celsius) - hardcoded as per the example
+        split_factor=float(input.Split_Factor()),  # Split Factor
+        rod_length=float(input.Rod_lenght()),  # Rod Length (meters)
+        rod_diameter=float(input.Rod_diameter()),  # Rod Diameter (meters)
+        case=input.Rpt_model() if input.Advanced_Options() else "Sverak",  # Grounding Resistance Model
+        override_mesh=input.input_OverrideMesh(),  # Input override Mesh
+        parallel_separ=float(input.Parallel_Separ()),  # advanced options to define D
     )
-    # Format the results for display in a tabulated way ---- TEXT----
-    # formatted_results = "\n".join([f"{key:<30}: {value}" for key, value in results.items()])
-    # return f"Calculation Results:\n{formatted_results}"
 
-    return results, filepath, inputs_dict
+@reactive.extended_task
+async def calc_task(inputs):
+    """
+    Kernel run on the worker pool, so the session stays responsive while a large
+    drawing is processed. The progress bar follows the stages of the kernel.
+    """
+    run = BackgroundRun()
+    with ui.Progress(min=0, max=len(STAGES)) as bar:
+        bar.set(0, message="Calculating", detail="parse")
+
+        def on_progress(done, total, phase, name):
+            bar.set(done, message=f"Calculating ({phase})", detail=name)
+
+        try:
+            results = await run_ground_grid(inputs, on_progress, run)
+        except asyncio.CancelledError:
+            kernel_runs["cancelled"] += 1
+            raise
+
+    kernel_runs["pending"] += 1
+    kernel_runs["total"] += 1
+    kernel_runs["recomputed"] = run.recomputed
+    return results, inputs
+
+# Time at which the next run starts, pushed back by every input change
+next_run = reactive.value(None)
+# Inputs of the last run started
+run_inputs = {"inputs": None}
+# False while a value is not a number, the results of the previous inputs are then hidden
+inputs_valid = reactive.value(True)
+
+@reactive.effect
+def schedule_calculation():
+    # A burst of edits (a value being typed) gives a single run, once the inputs settle
+    try:
+        calc_inputs()
+    except ValueError:
+        pass
+    with reactive.isolate():
+        if next_run() is not None:
+            kernel_runs["debounced"] += 1
+    next_run.set(time.monotonic() + DEBOUNCE_SECONDS)
 
-    # print("tabledata",table_data)
-    # return table_data
+@reactive.effect
+@reactive.event(input.Calculate)
+def calculate_now():
+    next_run.set(time.monotonic())
+
+@reactive.effect
+def start_calculation():
+    due = next_run()
+    if due is None:
+        return
+    if due > time.monotonic():
+        reactive.invalidate_later(due - time.monotonic())
+        return
+    next_run.set(None)
+
+    with reactive.isolate():
+        try:
+            inputs = calc_inputs()
+        except ValueError:
+            # A value is not a number, the outputs are cleared until it is fixed
+            run_inputs["inputs"] = None
+            calc_task.cancel()
+            inputs_valid.set(False)
+            return
+        inputs_valid.set(True)
+
+        # The results (or the run going on) are already those of these inputs
+        if inputs is not None and inputs == run_inputs["inputs"] and calc_task.status() in ("running", "success"):
+            kernel_runs["unchanged"] += 1
+            return
+
+    # The run still going on is out of date
+    calc_task.cancel()
+    run_inputs["inputs"] = inputs
+    if inputs is not None:
+        calc_task.invoke(inputs)
+
+@reactive.calc
+def Calc_results():
+    """
+    Results of the last run. Every output reads this calc; while a run is going on
+    they show it is in progress, and while a value is not a number they are empty.
+    """
+    if dxf_upload() is None:
+        return None, None, None
+
+    req(inputs_valid())
+    results, inputs = calc_task.result()
+    return results, inputs["filepath"], report_inputs(inputs)
+
+def log_kernel_runs():
+    # Called after every reactive flush, i.e. once the outputs of an interaction are updated
+    if kernel_runs["pending"]:
+        kernel_runs["interactions"] += 1
+        recomputed = ", ".join(kernel_runs["recomputed"] or []) or "none"
+        print(f"Interaction {kernel_runs['interactions']}: {kernel_runs['pending']} kernel run(s), "
+              f"{kernel_runs['total']} in the session ({kernel_runs['cancelled']} cancelled), "
+              f"stages recomputed: {recomputed}. Runs avoided: {kernel_runs['debounced']} debounced, "
+              f"{kernel_runs['unchanged']} unchanged, {calculation_stats['coalesced']} shared in the process")
+        kernel_runs["pending"] = 0
+
+_log_kernel_runs = session.on_flushed(log_kernel_runs, once=False)
+
+
+# Functions definitions
+
+def report_inputs(inputs):
+    # Inputs as shown in the report
+    return {
+    "Filepath": inputs["filepath"],
+    "DXF Drawing Units": inputs["fileunits"],
+    "Conductor Type": inputs["conductor_type"],
+    "Conductor Short Circuit": f"{inputs['short_circuit_conductor']} kA",
+    "Short Circuit Current": f"{inputs['short_circuit']} kA",
+    "Fault Duration": f"{inputs['fault_duration']} seconds",
+    "Person Weight": f"{inputs['person_weight']} kg",
+    "Split Factor": inputs["split_factor"],
+    "Soil Resistivity": f"{inputs['ro']} Ohm-m",
+    "Crushed Rock Resistivity": f"{inputs['ros']} Ohm-m",
+    "Crushed Rock Depth": f"{inputs['depth_crushed_rock']} meters",
+    "Conductors Depth": f"{inputs['cable_depth']} meters",
+    "Rods Length": f"{inputs['rod_length']} meters",
+    "Rods Diameter": f"{inputs['rod_diameter']} meters",
+    "Ambient Temperature": f"{inputs['ambient_temperature']} °C",
+    "Grounding Resistance Model": inputs["case"],
+    "Override Drawing Mesh": inputs["override_mesh"],
+    "Mesh Size": inputs["parallel_separ"]
+    }
 
 def results_to_pd(results, filepath):
 
@@ -353,15 +485,13 @@ def results_to_pd(results, filepath):
         empty_df = pd.DataFrame([])
         return empty_df, empty_df
     
-    # format the results for table display
-    table_data = []
-    table_data=pd.DataFrame([{"Parameter": key, "Value": value} for key, value in results.items()])
-
-    table_data = table_data.iloc[:-2]  # Exclude the last two rows
+    # format the results for table display, without the status texts
+    rows = [{"Parameter": key, "Value": value} for key, value in format_results(results).items()
+            if key not in STATUS_KEYS]
 
-    # Split the DataFrame into two parts
-    table_part1 = table_data.iloc[:6]  # First 6 rows
-    table_part2 = table_data.iloc[6:]  # Remaining rows
+    # Split the table in the cable sizing part and the voltages part
+    table_part1 = pd.DataFrame([row for row in rows if row["Parameter"] in SUMMARY_KEYS])
+    table_part2 = pd.DataFrame([row for row in rows if row["Parameter"] not in SUMMARY_KEYS])
 
     return table_part1, table_part2    
 
@@ -0,0 +1,184 @@
+"""
+Background runs of the kernel for the GUI.
+
+The calculations run on a thread pool shared by all the sessions of the process, so
+the event loop (and every other output) stays responsive while a large drawing is
+parsed and analysed. A run reports the stage it is at, and can be cancelled: it then
+stops before its next stage.
+
+Identical requests made while a calculation is running (same drawing content and
+same values, e.g. from two sessions) wait for that calculation instead of starting
+another one.
+
+An uploaded drawing is parsed and analysed (prefetch_drawing) as soon as it is
+received, while the other inputs are filled in; its calculations then find the
+geometry in the kernel memo.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from kernel import ground_grid, default_pipeline, STAGES
+from GUI.upload_cache import upload_cache
+
+# Phase shown for every kernel stage, the others are part of the calculation
+PHASES = {"parse": "parse", "geometry": "geometry", "mesh_size": "geometry"}
+
+# Set GROUNDING_GUI_WORKERS to change the number of calculations run at the same time
+WORKERS = int(os.environ.get("GROUNDING_GUI_WORKERS", min(4, os.cpu_count() or 1)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Calculations in the pool by request key. Only used from the event loop.
+_in_flight = {}
+
+# Requests received, calculations started, requests joining a running calculation,
+# calculations cancelled and drawings prefetched, for the whole process
+stats = {"requests": 0, "computed": 0, "coalesced": 0, "cancelled": 0, "prefetched": 0}
+
+
+class CalculationCancelled(Exception):
+    """
+    Raised in the worker when a run is cancelled, its inputs are out of date.
+    """
+
+
+class BackgroundRun:
+    """
+    Cancellation flag of a calculation, checked by the worker before every stage.
+    Once the calculation is done, recomputed lists the stages not taken from the memo.
+    """
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self.recomputed = None
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+
+class _Flight:
+    # A calculation in the pool and the requests waiting for it
+    def __init__(self):
+        self.run = BackgroundRun()
+        self.listeners = []
+        self.waiters = 0
+        self.future = None
+
+    def report(self, done, total, phase, name):
+        if not self.run.cancelled:
+            for listener in list(self.listeners):
+                listener(done, total, phase, name)
+
+
+def worker_pool():
+    """
+    Thread pool of the calculations, created on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="ground_grid")
+    return _pool
+
+def request_key(inputs):
+    """
+    Key of a calculation: the content of the drawing, so that the uploads of the same
+    file by different sessions match, and the values of the other inputs.
+    """
+    values = tuple(sorted((name, repr(value)) for name, value in inputs.items() if name != "filepath"))
+    return default_pipeline.file_key(inputs["filepath"]), values
+
+def _start(inputs, loop):
+    flight = _Flight()
+    names = list(STAGES)
+
+    def progress(name):
+        if flight.run.cancelled or loop.is_closed():
+            raise CalculationCancelled()
+        loop.call_soon_threadsafe(flight.report, names.index(name), len(names), PHASES.get(name, "calc"), name)
+
+    def calculate():
+        results = ground_grid(**inputs, progress=progress)
+        flight.run.recomputed = default_pipeline.recomputed()
+        return results
+
+    flight.future = loop.run_in_executor(worker_pool(), calculate)
+    return flight
+
+async def run_ground_grid(inputs, on_progress=None, run=None):
+    """
+    Run ground_grid(**inputs) on the worker pool, or wait for the identical calculation
+    already running.
+
+    Args:
+        inputs: Arguments of ground_grid.
+        on_progress: Called in the event loop before every stage, as
+                     on_progress(done, total, phase, stage), with done the number of
+                     stages already run and phase "parse", "geometry" or "calc".
+        run: Optional BackgroundRun, given the recomputed stages once done.
+
+    Cancelling the task awaiting this coroutine cancels the calculation when no other
+    request waits for it; the worker then drops it before its next stage.
+    """
+    loop = asyncio.get_running_loop()
+    key = request_key(inputs)
+    stats["requests"] += 1
+
+    flight = _in_flight.get(key)
+    if flight is None:
+        flight = _in_flight[key] = _start(inputs, loop)
+
+        def done(future):
+            if _in_flight.get(key) is flight:
+                del _in_flight[key]
+            if not future.cancelled():
+                future.exception()  # Seen, a dropped calculation ends with CalculationCancelled
+        flight.future.add_done_callback(done)
+        stats["computed"] += 1
+    else:
+        stats["coalesced"] += 1
+
+    if on_progress is not None:
+        flight.listeners.append(on_progress)
+    flight.waiters += 1
+    try:
+        results = await asyncio.shield(flight.future)
+    except asyncio.CancelledError:
+        flight.waiters -= 1
+        if flight.waiters == 0:
+            flight.run.cancel()
+            stats["cancelled"] += 1
+            # Identical requests made from now on start a new calculation
+            if _in_flight.get(key) is flight:
+                del _in_flight[key]
+        raise
+    finally:
+        if on_progress is not None:
+            flight.listeners.remove(on_progress)
+
+    flight.waiters -= 1
+    if run is not None:
+        run.recomputed = flight.run.recomputed
+    return results
+
+async def prefetch_drawing(filepath, units, name=None):
+    """
+    Parse an uploaded drawing and compute its geometry properties on the worker pool,
+    ahead of its first calculation.
+
+    Returns the UploadEntry of the drawing. A calculation started meanwhile waits for
+    the stages being prefetched instead of computing them again.
+    """
+    def load():
+        entry = upload_cache.get(filepath, units, name)
+        entry.geometry.compute_all()
+        return entry
+
+    stats["prefetched"] += 1
+    return await asyncio.get_running_loop().run_in_executor(worker_pool(), load)
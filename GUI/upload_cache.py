@@ -0,0 +1,185 @@
+"""
+Cache of the uploaded drawings, shared by all the sessions of the GUI process.
+
+Entries are keyed by the content of the DXF file (SHA-256) and the drawing units, so
+colleagues loading the same standard substation drawing share its parsed arrays and
+its Geom_etry (its preview images are shared by plots.grid_png). The Geom_etry is
+the one of the kernel memo, so the properties computed by a calculation are kept
+with it. When the estimated size goes over max_bytes, the least recently used
+drawings are dropped, from this cache and from the kernel memo, so that their memory
+is released.
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+
+from kernel import default_pipeline
+
+# Set GROUNDING_UPLOAD_CACHE_MB to change the memory cap of the process-wide cache
+DEFAULT_MAX_BYTES = int(os.environ.get("GROUNDING_UPLOAD_CACHE_MB", 512)) * 2**20
+
+
+def estimate_bytes(value, seen=None):
+    """
+    Approximate memory used by a value: NumPy buffers, bytes, and the objects and
+    containers it refers to, each counted once.
+    """
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    if isinstance(value, np.ndarray):
+        # A view is counted through the array owning its buffer
+        if isinstance(value.base, np.ndarray):
+            return estimate_bytes(value.base, seen)
+        # An object array only holds pointers, its elements are counted as well
+        if value.dtype == object:
+            return value.nbytes + sum(estimate_bytes(item, seen) for item in value.ravel().tolist())
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str, int, float, bool)) or value is None:
+        return sys.getsizeof(value)
+    # Copies, another thread may be computing the properties of a geometry
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_bytes(k, seen) + estimate_bytes(v, seen)
+                                          for k, v in list(value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_bytes(item, seen) for item in list(value))
+    if hasattr(value, "__dict__"):
+        return sys.getsizeof(value) + estimate_bytes(vars(value), seen)
+    if isinstance(value, shapely.Geometry):
+        return sys.getsizeof(value) + 16 * int(shapely.get_num_coordinates(value))
+    return sys.getsizeof(value)
+
+
+class UploadEntry:
+    """
+    What is kept of an uploaded drawing.
+
+    Attributes:
+        lines, rods: Parsed arrays, in meters.
+        geometry: Geom_etry of the drawing.
+    """
+    def __init__(self, name, units, lines, rods, geometry):
+        self.name = name
+        self.units = units
+        self.lines = lines
+        self.rods = rods
+        self.geometry = geometry
+        self.nbytes = 0
+        self.last_used = time.time()
+
+    def size(self):
+        return estimate_bytes((self.lines, self.rods, self.geometry))
+
+
+class UploadCache:
+    """
+    Process-wide LRU cache of the uploaded drawings, capped to max_bytes.
+
+    Use get() for the entry of an upload, parsed on a miss (once even when several
+    sessions ask at the same time).
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, pipeline=None):
+        self.max_bytes = max_bytes
+        self.pipeline = pipeline or default_pipeline
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def key(self, filepath, units):
+        return self.pipeline.file_key(filepath), units
+
+    def get(self, filepath, units, name=None):
+        """
+        Entry of an uploaded drawing, parsed (through the kernel memo) on a miss.
+        """
+        key = self.key(filepath, units)
+        with self._lock:
+            entry = self._touch(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            # Only one thread parses a drawing, the others wait for it
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        with loading:
+            with self._lock:
+                entry = self._touch(key)
+                if entry is not None:
+                    self.hits += 1
+                    return entry
+                self.misses += 1
+
+            lines, rods = self.pipeline.run(until="parse", filepath=filepath, fileunits=units)
+            geometry = self.pipeline.run(until="geometry", filepath=filepath, fileunits=units)
+            entry = UploadEntry(name or os.path.basename(filepath), units, lines, rods, geometry)
+            entry.nbytes = entry.size()
+
+            with self._lock:
+                self._entries[key] = entry
+                self._loading.pop(key, None)
+        self._evict()
+        return entry
+
+    def _touch(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            entry.last_used = time.time()
+        return entry
+
+    def _refresh_sizes(self):
+        # Sizes are estimated again, the geometry grows as its properties are computed.
+        # The estimate walks the entries, so it is done without holding the lock.
+        with self._lock:
+            entries = list(self._entries.values())
+        for entry in entries:
+            entry.nbytes = entry.size()
+        return entries
+
+    def _evict(self):
+        self._refresh_sizes()
+        evicted = []
+        with self._lock:
+            while len(self._entries) > 1 and self.total_bytes() > self.max_bytes:
+                key, _ = self._entries.popitem(last=False)
+                evicted.append(key)
+                self.evictions += 1
+        for key in evicted:
+            self.pipeline.forget(*key)
+
+    def total_bytes(self):
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries)
+            self._entries.clear()
+        for key in keys:
+            self.pipeline.forget(*key)
+
+    def stats(self):
+        """
+        Totals of the cache and one row per drawing, most recently used first.
+        """
+        entries = [{"drawing": entry.name, "units": entry.units, "segments": len(entry.lines),
+                    "rods": len(entry.rods), "MB": entry.nbytes / 2**20,
+                    "last used": time.strftime("%H:%M:%S", time.localtime(entry.last_used))}
+                   for entry in reversed(self._refresh_sizes())]
+        totals = {"drawings": len(entries), "MB": sum(row["MB"] for row in entries),
+                  "max MB": self.max_bytes / 2**20, "hits": self.hits, "misses": self.misses,
+                  "evictions": self.evictions}
+        return totals, entries
+
+
+# Cache shared by the sessions
+upload_cache = UploadCache()
@@ -0,0 +1,241 @@
+"""
+Command line batch runner for the grounding grid calculation.
+
+Reads scenarios (the ground_grid arguments) from a CSV or JSONL file, runs them with
+ground_grid_many and writes one row per scenario to a CSV or JSONL file as soon as it
+is ready. Only a few chunks of scenarios are in memory at any time.
+
+Example:
+    python batch.py scenarios.csv results.csv --workers 8
+    python batch.py scenarios.jsonl results.jsonl --resume
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from dataclasses import asdict, fields
+
+import parser.cache as parser_cache
+from kernel import ground_grid_many
+from instrumentation import recording
+from calcs.class_result import GroundGridResult
+
+
+# Type of each ground_grid argument, used to read the CSV text values
+SCENARIO_TYPES = {
+    "filepath": str, "fileunits": str, "conductor_type": str, "short_circuit_conductor": float,
+    "short_circuit": float, "fault_duration": float, "person_weight": float, "cable_depth": float,
+    "depth_crushed_rock": float, "ro": float, "ros": float, "ambient_temperature": float,
+    "split_factor": float, "rod_length": float, "rod_diameter": float, "case": str,
+    "override_mesh": bool, "parallel_separ": float,
+}
+
+# Values used when a column is missing, as in the GUI
+SCENARIO_DEFAULTS = {"ambient_temperature": 40, "split_factor": 1, "case": "Sverak",
+                     "override_mesh": False, "parallel_separ": 8}
+
+RESULT_COLUMNS = [field.name for field in fields(GroundGridResult)] + ["compliant", "error"]
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    return bool(value)
+
+def to_scenario(record):
+    """
+    Build the ground_grid arguments from a record, converting the text values.
+    """
+    scenario = dict(SCENARIO_DEFAULTS)
+    for key, value in record.items():
+        if key in SCENARIO_TYPES and value not in (None, ""):
+            scenario[key] = _to_bool(value) if SCENARIO_TYPES[key] is bool else SCENARIO_TYPES[key](value)
+    missing = [key for key in SCENARIO_TYPES if key not in scenario]
+    if missing:
+        raise ValueError(f"Missing scenario values: {', '.join(missing)}")
+    return scenario
+
+def file_format(path, given=None):
+    if given:
+        return given
+    return "jsonl" if path.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+def read_records(path, fmt):
+    """
+    Stream the records of a CSV or JSONL file.
+    """
+    with open(path, newline="") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def resume_offset(path, fmt, block_size=64 * 1024):
+    """
+    Input row following the last one written to an output file (0 if there is none).
+    A row left half written by an interrupted run is removed.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 0
+
+    with open(path, "rb+") as f:
+        # Drop everything after the last line break, found reading back from the end
+        # one block at a time so that a large output is never loaded
+        end = position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            start = max(position - block_size, 0)
+            f.seek(start)
+            found = f.read(position - start).rfind(b"\n")
+            if found >= 0:
+                end = start + found + 1
+                break
+            position = start
+        else:
+            end = 0
+        f.truncate(end)
+
+    last = None
+    for record in read_records(path, fmt):
+        last = record
+    return int(last["row"]) + 1 if last is not None else 0
+
+def to_row(index, record, result):
+    row = {"row": index, **record}
+    if isinstance(result, Exception):
+        for column in RESULT_COLUMNS:
+            row.setdefault(column, None)
+        row["error"] = f"{type(result).__name__}: {result}"
+    else:
+        row.update(asdict(result))
+        row["compliant"] = result.compliant
+        row["error"] = None
+    return row
+
+
+class _RecordScenarios:
+    # Keeps the records of the scenarios in flight, to write them next to the results
+    def __init__(self, records):
+        self.records = records
+        self.pending = {}
+        self.invalid = {}
+
+    def __iter__(self):
+        for index, record in enumerate(self.records):
+            self.pending[index] = record
+            try:
+                yield to_scenario(record)
+            except ValueError as error:
+                # Still goes through ground_grid_many to keep the numbering, the error
+                # is reported in place of its result
+                self.invalid[index] = error
+                yield {"filepath": None, "fileunits": None}
+
+
+def run(input_path, output_path, input_format=None, output_format=None, workers=1, chunksize=64,
+        start=0, resume=False, progress=None):
+    """
+    Run the scenarios of input_path and write the results to output_path.
+
+    Args:
+        workers: Number of processes.
+        chunksize: Scenarios sent to a worker at once, also the flush interval.
+        start: Number of input rows to skip.
+        resume: Continue a previous run, skipping the rows already in output_path.
+        progress: Optional callable receiving the number of rows written so far.
+
+    Returns:
+        (rows written, rows with errors)
+    """
+    input_format = file_format(input_path, input_format)
+    output_format = file_format(output_path, output_format)
+
+    if resume:
+        start = max(start, resume_offset(output_path, output_format))
+    append = resume and os.path.exists(output_path) and os.path.getsize(output_path) > 0
+
+    scenarios = _RecordScenarios(itertools.islice(read_records(input_path, input_format), start, None))
+    results = ground_grid_many(scenarios, workers=workers, chunksize=chunksize,
+                               return_exceptions=True)
+
+    written = errors = 0
+    with open(output_path, "a" if append else "w", newline="") as f:
+        writer = None
+        for index, result in results:
+            record = scenarios.pending.pop(index)
+            result = scenarios.invalid.pop(index, result)
+            row = to_row(start + index, record, result)
+            errors += row["error"] is not None
+
+            if output_format == "csv":
+                if writer is None:
+                    writer = csv.DictWriter(f, fieldnames=list(row), extrasaction="ignore")
+                    if not append:
+                        writer.writeheader()
+                writer.writerow(row)
+            else:
+                f.write(json.dumps(row) + "\n")
+
+            written += 1
+            if written % chunksize == 0:
+                f.flush()
+                if progress is not None:
+                    progress(written)
+
+    return written, errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run grounding grid scenarios from a CSV or JSONL file.")
+    parser.add_argument("input", help="CSV or JSONL file with one scenario per row (ground_grid arguments).")
+    parser.add_argument("output", help="CSV or JSONL file for the results.")
+    parser.add_argument("--input-format", choices=("csv", "jsonl"), help="Defaults to the file extension.")
+    parser.add_argument("--output-format", choices=("csv", "jsonl"), help="Defaults to the file extension.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes (0 for all the CPUs).")
+    parser.add_argument("--chunksize", type=int, default=64, help="Scenarios per task and per flush.")
+    parser.add_argument("--start", type=int, default=0, help="Skip the first START input rows.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue a previous run after the rows already in the output file.")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Read the DXF files entity by entity, with bounded memory on large drawings.")
+    parser.add_argument("--timings", action="store_true",
+                        help="Print the time spent in every stage (stages run in this process only, "
+                             "use --workers 1 to see them all).")
+    parser.add_argument("--timings-json", help="Save the stage timings to a JSON file.")
+    parser.add_argument("--trace", help="Save the stage timings as a Chrome trace (chrome://tracing, Perfetto).")
+    parser.add_argument("--cprofile", help="Run cProfile and save the stats to this file.")
+    args = parser.parse_args(argv)
+
+    if args.streaming:
+        # Also seen by the worker processes, which may import the modules again
+        os.environ["GROUNDING_STREAMING_DXF"] = "1"
+        parser_cache.STREAMING = True
+
+    started = time.perf_counter()
+
+    def progress(written):
+        print(f"\r{written} rows", end="", file=sys.stderr, flush=True)
+
+    with recording(profile=bool(args.cprofile)) as recorder:
+        written, errors = run(args.input, args.output, args.input_format, args.output_format,
+                              workers=args.workers or None, chunksize=args.chunksize, start=args.start,
+                              resume=args.resume, progress=progress)
+    elapsed = time.perf_counter() - started
+    print(f"\r{written} rows written to {args.output} in {elapsed:.1f} s, {errors} with errors", file=sys.stderr)
+
+    if args.timings:
+        print(recorder.summary_table(), file=sys.stderr)
+    if args.timings_json:
+        recorder.write_json(args.timings_json)
+    if args.trace:
+        recorder.write_chrome_trace(args.trace)
+    if args.cprofile:
+        recorder.write_profile(args.cprofile)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
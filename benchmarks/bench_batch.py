@@ -0,0 +1,49 @@
+# Benchmark of the batched GroundingGrid evaluation against one object per scenario.
+# Run from the repository root: python -m benchmarks.bench_batch
+
+import time
+import numpy as np
+
+from calcs.class_grid import GroundingGrid
+
+
+# IEEE 80 Appendix B, example 2 geometry
+SIDE = 70
+GEOMETRY = dict(cable_diameter=0.01, rod_diameter=0.02, location_rods="perimeter", shape="rectangle",
+                side1=SIDE, side2=SIDE, side3=0, side4=0, A=SIDE * SIDE, Lc=1540, Lp=4 * SIDE,
+                Dm=np.hypot(SIDE, SIDE), Lx=SIDE, Ly=SIDE)
+
+
+def scenarios(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return dict(ro=rng.uniform(50, 1000, n), cable_depth=rng.uniform(0.3, 1.5, n), D=rng.uniform(3, 15, n),
+                num_rods=rng.integers(0, 40, n), rod_length=rng.uniform(3, 10, n)), rng.uniform(500, 5000, n)
+
+
+def batched(inputs, current, case):
+    return GroundingGrid(**inputs, case=case, **GEOMETRY).evaluate(current)
+
+
+def one_by_one(inputs, current, case):
+    results = []
+    for i in range(len(current)):
+        grid = GroundingGrid(**{key: value[i] for key, value in inputs.items()}, case=case, **GEOMETRY)
+        results.append((grid.Rpt, grid.Em(current[i]), grid.Es(current[i])))
+    return results
+
+
+if __name__ == "__main__":
+    print(f"{'case':>10} {'scenarios':>10} {'batched (ms)':>14} {'objects (ms)':>14}")
+    for case in ("Sverak", "Schwarz"):
+        for n in (1_000, 10_000, 100_000):
+            inputs, current = scenarios(n)
+            start = time.perf_counter()
+            batched(inputs, current, case)
+            t_batch = time.perf_counter() - start
+
+            # The object loop is timed on 1000 scenarios and scaled
+            m = min(n, 1_000)
+            start = time.perf_counter()
+            one_by_one({key: value[:m] for key, value in inputs.items()}, current[:m], case)
+            t_loop = (time.perf_counter() - start) * n / m
+            print(f"{case:>10} {n:>10} {t_batch * 1e3:14.2f} {t_loop * 1e3:14.0f}")
@@ -0,0 +1,29 @@
+# Benchmark of eager and lazy construction of Geom_etry and of the mesh extraction on large grids.
+# Run from the repository root: python -m benchmarks.bench_geometry
+
+import time
+import numpy as np
+
+from calcs.class_geom_etry import Geom_etry
+from benchmarks.dxf_generator import grid_geometry
+
+
+def timed(func, repeat=5):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    print(f"{'segments':>10} {'rods':>8} {'eager (ms)':>12} {'area (ms)':>12} {'hull (ms)':>12} {'meshes (ms)':>12}")
+    for n_meshes in (10, 50, 100, 200):
+        # Rods on the perimeter and on about one interior node in 16
+        lines, rods = grid_geometry("rectangle", n_meshes, n_meshes, mesh_size=7.0, rod_step=4, rod_density=1 / 16)
+        eager = timed(lambda: Geom_etry(lines, rods).compute_all())
+        area = timed(lambda: Geom_etry(lines, rods).area)
+        hull = timed(lambda: Geom_etry(lines, rods).hull)
+        meshes = timed(lambda: Geom_etry(lines, rods).meshes, repeat=1)
+        print(f"{len(lines):>10} {len(rods):>8} {eager * 1e3:12.2f} {area * 1e3:12.2f} {hull * 1e3:12.2f} {meshes * 1e3:12.2f}")
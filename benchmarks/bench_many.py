@@ -0,0 +1,38 @@
+# Throughput of ground_grid_many on a portfolio-like scenario matrix.
+# Run from the repository root: python -m benchmarks.bench_many [n_scenarios]
+
+import itertools
+import os
+import sys
+import time
+
+from kernel import ground_grid_many
+
+
+DRAWINGS = [("Fig_B2__mm.dxf", "mm"), ("Fig_B3__m.dxf", "m"), ("Fig_B4__mm.dxf", "mm")]
+BASE = dict(conductor_type="Copper, anealed soft-drawn", short_circuit_conductor=6.814, person_weight=70,
+            cable_depth=0.5, depth_crushed_rock=0.102, ros=2500, ambient_temperature=40, split_factor=0.6,
+            rod_diameter=0.02, case="Sverak", override_mesh=False, parallel_separ=8)
+
+
+def scenarios(n):
+    """
+    Soil resistivity surveys x fault levels x rod options for every drawing.
+    """
+    matrix = itertools.product(DRAWINGS, range(50, 1050, 50), (1.0, 2.0, 3.18, 5.0, 10.0),
+                               (0.3, 0.5, 1.0), (3.0, 7.5, 10.0))
+    for (filepath, fileunits), ro, short_circuit, fault_duration, rod_length in itertools.islice(
+            itertools.cycle(matrix), n):
+        yield dict(BASE, filepath=filepath, fileunits=fileunits, ro=ro, short_circuit=short_circuit,
+                   fault_duration=fault_duration, rod_length=rod_length)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    print(f"{os.cpu_count()} CPUs available, {n} scenarios")
+    print(f"{'workers':>8} {'seconds':>10} {'scenarios/s':>12}")
+    for workers in sorted({1, 4, os.cpu_count() or 1}):
+        start = time.perf_counter()
+        count = sum(1 for _ in ground_grid_many(scenarios(n), workers=workers))
+        elapsed = time.perf_counter() - start
+        print(f"{workers:>8} {elapsed:10.2f} {count / elapsed:12.0f}")
@@ -0,0 +1,66 @@
+# Benchmark of the overlapped lines removal in the DXF parser.
+# Run from the repository root: python -m benchmarks.bench_overlaps
+
+import time
+import numpy as np
+
+from parser.parser import remove_overlapping_lines, is_overlapping, line_length
+
+
+def synthetic_lines(n_segments, duplicate_ratio=0.1, seed=0):
+    """
+    Build a square grid split in unit segments, with a share of repeated and
+    sub-segments on top of it, as it happens when drawings are merged.
+    """
+    rng = np.random.default_rng(seed)
+    n_unique = int(n_segments * (1 - duplicate_ratio))
+    side = max(int(np.sqrt(n_unique / 2)), 1)
+
+    lines_list = []
+    for i in range(side + 1):
+        for j in range(side):
+            lines_list.append([(float(j), float(i)), (float(j + 1), float(i))])
+            lines_list.append([(float(i), float(j)), (float(i), float(j + 1))])
+    lines_list = lines_list[:n_unique]
+
+    for k in rng.integers(0, len(lines_list), n_segments - len(lines_list)):
+        (x1, y1), (x2, y2) = lines_list[k]
+        lines_list.append([(x1 + 0.25 * (x2 - x1), y1 + 0.25 * (y2 - y1)), (x2, y2)])
+
+    rng.shuffle(lines_list)
+    return lines_list
+
+
+def legacy_pairwise(lines_list):
+    # Pairwise comparison as it was done in process_dxf
+    filtered_lines = lines_list.copy()
+    for line in lines_list:
+        for line2 in lines_list:
+            if line != line2 and is_overlapping(line, line2):
+                if line_length(line) < line_length(line2):
+                    if line in filtered_lines:
+                        filtered_lines.remove(line)
+                        break
+    return filtered_lines
+
+
+def timed(func, *args, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    print(f"{'segments':>10} {'kept':>10} {'bucketed (s)':>14} {'pairwise (s)':>14}")
+    for n in (1_000, 2_000, 5_000, 10_000, 20_000, 50_000, 100_000):
+        lines_list = synthetic_lines(n)
+        t_new, kept = timed(remove_overlapping_lines, lines_list)
+        if n <= 2_000:
+            t_old, _ = timed(legacy_pairwise, lines_list, repeat=1)
+            t_old = f"{t_old:14.3f}"
+        else:
+            t_old = f"{'-':>14}"
+        print(f"{n:>10} {len(kept):>10} {t_new:14.3f} {t_old}")
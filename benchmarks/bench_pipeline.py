@@ -0,0 +1,56 @@
+# Benchmark of the memoised ground_grid pipeline on a sequence of GUI-like edits.
+# Run from the repository root: python -m benchmarks.bench_pipeline
+
+import time
+
+from kernel import ground_grid, GroundGridPipeline
+
+
+# IEEE 80 Appendix B, example 2
+BASE = dict(filepath="Fig_B2__mm.dxf", fileunits="mm", conductor_type="Copper, anealed soft-drawn",
+            short_circuit_conductor=6.814, short_circuit=3.18, fault_duration=0.5, person_weight=70,
+            cable_depth=0.5, depth_crushed_rock=0.102, ro=400, ros=2500, ambient_temperature=40,
+            split_factor=0.6, rod_length=7.5, rod_diameter=0.02, case="Sverak", override_mesh=False,
+            parallel_separ=8)
+
+# (description, edit applied on top of the previous inputs), like a user going through the form
+EDITS = [
+    ("fault duration", dict(fault_duration=0.6)),
+    ("person weight", dict(person_weight=50)),
+    ("soil resistivity", dict(ro=300)),
+    ("split factor", dict(split_factor=0.8)),
+    ("model", dict(case="Schwarz")),
+    ("rod length", dict(rod_length=10)),
+    ("file", dict(filepath="Fig_B3__m.dxf", fileunits="m")),
+    ("back to first file", dict(filepath="Fig_B2__mm.dxf", fileunits="mm")),
+]
+
+
+def time_edits(pipeline_factory, repeat=20):
+    """
+    Time the call following each edit, on a pipeline that already ran the base inputs.
+    """
+    timings = []
+    inputs = dict(BASE)
+    for description, edit in EDITS:
+        previous = dict(inputs)
+        inputs.update(edit)
+        elapsed = 0.0
+        for _ in range(repeat):
+            pipeline = pipeline_factory()
+            ground_grid(**previous, pipeline=pipeline)
+            start = time.perf_counter()
+            ground_grid(**inputs, pipeline=pipeline)
+            elapsed += time.perf_counter() - start
+        timings.append((description, elapsed / repeat, pipeline.recomputed()))
+    return timings
+
+
+if __name__ == "__main__":
+    # The parsed DXF files come from the geometry cache in both cases
+    fresh = time_edits(lambda: GroundGridPipeline(max_entries=0))
+    memo = time_edits(GroundGridPipeline)
+
+    print(f"{'edit':>20} {'fresh (ms)':>12} {'memoised (ms)':>14}  recomputed")
+    for (description, t_fresh, _), (_, t_memo, recomputed) in zip(fresh, memo):
+        print(f"{description:>20} {t_fresh * 1e3:12.2f} {t_memo * 1e3:14.2f}  {', '.join(recomputed)}")
@@ -0,0 +1,194 @@
+# Scaling benchmark of the whole chain (parse -> geometry -> calc -> export) on synthetic
+# drawings from 10 to 100k segments, with a regression check against a stored baseline.
+# Run from the repository root:
+#     python -m benchmarks.bench_suite                    # up to 10k segments
+#     python -m benchmarks.bench_suite --full             # up to 100k segments
+#     python -m benchmarks.bench_suite --update-baseline  # store the current numbers
+# The exit status is 1 when a stage is slower or uses more memory than the baseline allows.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.dxf_generator import write_grid_dxf, lattice_for_segments
+from parser.cache import load_geometry
+from calcs.class_geom_etry import Geom_etry
+from kernel import ground_grid, GroundGridPipeline
+from outputs.format_results import format_results
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DRAWINGS_DIR = os.path.join(tempfile.gettempdir(), "grounding_synthetic")
+
+# (shape, approximate segments, non-grounding entities per grounding entity)
+QUICK = [("rectangle", 10, 0), ("rectangle", 100, 0), ("L", 1_000, 0), ("T", 1_000, 1),
+         ("irregular", 1_000, 0), ("rectangle", 10_000, 0), ("irregular", 10_000, 2)]
+FULL = QUICK + [("rectangle", 100_000, 0), ("T", 100_000, 0)]
+
+STAGES = ("parse", "geometry", "calc", "report", "plot")
+
+SCENARIO = dict(fileunits="m", conductor_type="Copper, anealed soft-drawn", short_circuit_conductor=6.814,
+                short_circuit=3.18, fault_duration=0.5, person_weight=70, cable_depth=0.5,
+                depth_crushed_rock=0.102, ro=400, ros=2500, ambient_temperature=40, split_factor=0.6,
+                rod_length=7.5, rod_diameter=0.02, case="Sverak", override_mesh=False, parallel_separ=8)
+
+
+def drawing(shape, segments, noise):
+    """
+    Path of the synthetic drawing, written the first time it is needed.
+    """
+    os.makedirs(DRAWINGS_DIR, exist_ok=True)
+    path = os.path.join(DRAWINGS_DIR, f"{shape}_{segments}_{noise}.dxf")
+    if not os.path.exists(path):
+        nx, ny = lattice_for_segments(segments, shape)
+        write_grid_dxf(path + ".tmp", shape, nx, ny, rod_step=2, rod_density=0.05, noise=noise)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def stage_functions(path, workdir, streaming=False):
+    """
+    The stages of the chain, each one taking the output of the previous one. With
+    streaming the drawing is parsed with the streaming reader.
+    """
+    from outputs.export_doc import generate_docx
+    from plots.plots import plot_grid_with_lines_and_rods, figure_png
+    import pandas as pd
+
+    def parse(_):
+        return load_geometry(path, "m", streaming=streaming, cache=None)
+
+    def geometry(parsed):
+        return Geom_etry(*parsed).compute_all()
+
+    def calc(_):
+        # Parse and geometry come from the memo of a pipeline warmed with other inputs
+        pipeline = GroundGridPipeline()
+        ground_grid(**dict(SCENARIO, filepath=path, ro=100), pipeline=pipeline)
+        start = time.perf_counter()
+        result = ground_grid(**dict(SCENARIO, filepath=path), pipeline=pipeline)
+        return result, time.perf_counter() - start
+
+    def report(result):
+        rows = [{"Parameter": key, "Value": value} for key, value in format_results(result).items()]
+        table = pd.DataFrame(rows)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return generate_docx(table.iloc[:6], table.iloc[6:-2], {}, os.path.join(workdir, "report.docx"))
+
+    def plot(parsed):
+        # Drawn and encoded as the GUI preview, without the image cache
+        lines, rods = parsed
+        return figure_png(plot_grid_with_lines_and_rods(lines=lines, rods=rods), 800, 400)
+
+    return parse, geometry, calc, report, plot
+
+
+def run_case(path, workdir, memory=True, plot_limit=None, streaming=False):
+    """
+    Time (seconds) and peak traced memory (MB) of every stage on one drawing. The plot
+    is skipped on drawings with more than plot_limit segments.
+    """
+    parse, geometry, calc, report, plot = stage_functions(path, workdir, streaming)
+    times, peaks = {}, {}
+
+    def measure(name, function, argument):
+        start = time.perf_counter()
+        output = function(argument)
+        times[name] = time.perf_counter() - start
+        if name == "calc":
+            output, times[name] = output
+        if memory:
+            tracemalloc.start()
+            function(argument)
+            peaks[name] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        return output
+
+    parsed = measure("parse", parse, None)
+    measure("geometry", geometry, parsed)
+    result = measure("calc", calc, None)
+    measure("report", report, result)
+    if plot_limit is None or len(parsed[0]) <= plot_limit:
+        measure("plot", plot, parsed)
+    return {"segments": len(parsed[0]), "time": times, "peak_mb": peaks}
+
+
+def check(results, baseline, time_tolerance, memory_tolerance, min_time=0.005):
+    """
+    List the stages over the baseline, allowing a relative tolerance, and ignoring
+    timings under min_time seconds which are mostly noise.
+    """
+    failures = []
+    for case, measured in results.items():
+        reference = baseline.get(case)
+        if reference is None:
+            continue
+        for stage in STAGES:
+            t, t_ref = measured["time"].get(stage), reference["time"].get(stage)
+            if t is not None and t_ref is not None and t > max(t_ref * (1 + time_tolerance), min_time):
+                failures.append(f"{case} {stage}: {t * 1e3:.1f} ms, baseline {t_ref * 1e3:.1f} ms")
+            m, m_ref = measured["peak_mb"].get(stage), reference["peak_mb"].get(stage)
+            if m is not None and m_ref is not None and m > max(m_ref * (1 + memory_tolerance), 1.0):
+                failures.append(f"{case} {stage}: {m:.1f} MB, baseline {m_ref:.1f} MB")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scaling benchmark of the grounding grid calculation chain.")
+    parser.add_argument("--full", action="store_true", help="Go up to 100k segments.")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the (slower) peak memory pass.")
+    parser.add_argument("--plot-limit", type=int, default=None,
+                        help="Skip the plot above this number of segments.")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--time-tolerance", type=float, default=0.5, help="Allowed slowdown (0.5 = 50 %%).")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    results = {}
+    nan = float("nan")
+    header = "".join(f"{stage + ' ms':>13}{'MB':>7}" for stage in STAGES)
+    print(f"{'drawing':<34}{'segments':>9}{header}")
+    with tempfile.TemporaryDirectory() as workdir:
+        # Untimed run, so that the first case does not pay for the imports
+        run_case(drawing("rectangle", 10, 0), workdir, memory=False)
+
+        # The drawings with other layers are also parsed with the streaming reader
+        cases = [(shape, segments, noise, False) for shape, segments, noise in (FULL if args.full else QUICK)]
+        cases += [(shape, segments, noise, True) for shape, segments, noise, _ in cases if noise]
+        for shape, segments, noise, streaming in cases:
+            case = f"{shape}_{segments}_{noise}" + ("_streaming" if streaming else "")
+            results[case] = measured = run_case(drawing(shape, segments, noise), workdir, not args.no_memory,
+                                                args.plot_limit, streaming)
+            cells = "".join(f"{measured['time'].get(stage, nan) * 1e3:13.1f}{measured['peak_mb'].get(stage, nan):7.1f}"
+                            for stage in STAGES)
+            print(f"{case:<34}{measured['segments']:>9}{cells}", flush=True)
+
+    if args.update_baseline:
+        stored = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                stored = json.load(f)
+        stored.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(stored, f, indent=1, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with, run with --update-baseline first.")
+        return 0
+    with open(args.baseline) as f:
+        failures = check(results, json.load(f), args.time_tolerance, args.memory_tolerance)
+    for failure in failures:
+        print("REGRESSION", failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+# Synthetic grounding grid drawings for the tests and the benchmarks.
+# Example, from the repository root:
+#     python -m benchmarks.dxf_generator grid.dxf --shape T --segments 10000 --noise 2
+
+import argparse
+import math
+
+import numpy as np
+
+from parser.parser import GROUNDING_LAYER
+
+SHAPES = ("rectangle", "L", "T", "irregular")
+NOISE_LAYERS = ("walls", "cable_trays", "annotations")
+
+
+def grid_cells(shape, nx, ny, rng=None):
+    """
+    Meshes (i, j) of an nx x ny lattice covered by the grid of the given shape.
+    """
+    cells = {(i, j) for i in range(nx) for j in range(ny)}
+    if shape == "rectangle":
+        return cells
+    if shape == "L":
+        # Without the top right quarter
+        return {(i, j) for i, j in cells if i < nx // 2 or j < ny // 2}
+    if shape == "T":
+        # Top bar over the whole width and a centred stem
+        return {(i, j) for i, j in cells if j >= ny - max(ny // 3, 1) or nx // 3 <= i < nx - nx // 3}
+    if shape == "irregular":
+        # Random connected blob grown from the centre, covering about 60 % of the lattice
+        rng = rng or np.random.default_rng(0)
+        blob = {(nx // 2, ny // 2)}
+        frontier = [(nx // 2, ny // 2)]
+        target = max(int(0.6 * nx * ny), 1)
+        while len(blob) < target and frontier:
+            i, j = frontier[rng.integers(len(frontier))]
+            di, dj = ((1, 0), (-1, 0), (0, 1), (0, -1))[rng.integers(4)]
+            cell = (i + di, j + dj)
+            if cell in cells and cell not in blob:
+                blob.add(cell)
+                frontier.append(cell)
+        return blob
+    raise ValueError(f"Unsupported shape: {shape}. Supported shapes are {SHAPES}.")
+
+def lattice_for_segments(segments, shape="rectangle"):
+    """
+    Lattice size (nx, ny) giving about the requested number of one-mesh segments.
+    """
+    fill = {"rectangle": 1.0, "L": 0.75, "T": 0.6, "irregular": 0.6}[shape]
+    # A grid of c meshes has about 2c + 2 sqrt(c) segments
+    n = max(int(math.ceil(math.sqrt(segments / (2 * fill)))), 2)
+    return n, n
+
+def grid_geometry(shape="rectangle", nx=10, ny=10, mesh_size=7.0, rod_step=2, rod_density=0.0, seed=0):
+    """
+    Lines and rods of a synthetic grid, with one segment per mesh side.
+
+    Args:
+        shape: "rectangle", "L", "T" or "irregular" (random outline and uneven spacing).
+        nx, ny: Size of the lattice, in meshes.
+        mesh_size: Mesh size in meters.
+        rod_step: A rod on every rod_step-th node of the perimeter (0 for none).
+        rod_density: Fraction of the interior nodes with a rod.
+
+    Returns:
+        lines: (N, 2, 2) array and rods: (M, 2) array, in meters.
+    """
+    rng = np.random.default_rng(seed)
+    cells = grid_cells(shape, nx, ny, rng)
+
+    xs = np.arange(nx + 1) * mesh_size
+    ys = np.arange(ny + 1) * mesh_size
+    if shape == "irregular":
+        xs = np.concatenate(([0], np.cumsum(rng.uniform(0.6, 1.4, nx) * mesh_size)))
+        ys = np.concatenate(([0], np.cumsum(rng.uniform(0.6, 1.4, ny) * mesh_size)))
+
+    # Mesh sides as pairs of lattice nodes, counting how many meshes share each one
+    sides = {}
+    for i, j in cells:
+        for side in (((i, j), (i + 1, j)), ((i, j + 1), (i + 1, j + 1)),
+                     ((i, j), (i, j + 1)), ((i + 1, j), (i + 1, j + 1))):
+            sides[side] = sides.get(side, 0) + 1
+
+    ordered = sorted(sides)
+    nodes = np.array(ordered).reshape(-1, 2, 2)
+    lines = np.stack((xs[nodes[..., 0]], ys[nodes[..., 1]]), axis=-1)
+
+    # Perimeter nodes are on sides of a single mesh
+    perimeter = sorted({node for side in ordered if sides[side] == 1 for node in side})
+    all_nodes = sorted({node for side in ordered for node in side})
+    interior = sorted(set(all_nodes) - set(perimeter))
+    rod_nodes = perimeter[::rod_step] if rod_step else []
+    if rod_density and interior:
+        chosen = rng.choice(len(interior), size=int(rod_density * len(interior)), replace=False)
+        rod_nodes = rod_nodes + [interior[k] for k in sorted(chosen)]
+    rods = np.array([(xs[i], ys[j]) for i, j in rod_nodes], dtype=np.float64).reshape(-1, 2)
+
+    return lines, rods
+
+def write_grid_dxf(path, shape="rectangle", nx=10, ny=10, mesh_size=7.0, rod_step=2, rod_density=0.0,
+                   noise=0.0, seed=0, units="m"):
+    """
+    Write a synthetic grounding grid to a DXF file.
+
+    The cables are LINE entities and the rods CIRCLE entities of the grounding layer.
+    With noise > 0, noise times as many entities (lines, polylines, circles and texts)
+    are added on other layers, as in a full site drawing.
+
+    Returns:
+        A dictionary with the number of segments, rods and noise entities written.
+    """
+    import ezdxf
+
+    lines, rods = grid_geometry(shape, nx, ny, mesh_size, rod_step, rod_density, seed)
+    scale = {"m": 1, "mm": 1000}[units]
+
+    doc = ezdxf.new()
+    doc.layers.add(GROUNDING_LAYER)
+    for layer in NOISE_LAYERS:
+        doc.layers.add(layer)
+    msp = doc.modelspace()
+
+    for (x1, y1), (x2, y2) in lines * scale:
+        msp.add_line((x1, y1), (x2, y2), dxfattribs={"layer": GROUNDING_LAYER})
+    for x, y in rods * scale:
+        msp.add_circle((x, y), 0.01 * scale, dxfattribs={"layer": GROUNDING_LAYER})
+
+    rng = np.random.default_rng(seed + 1)
+    n_noise = int(noise * (len(lines) + len(rods)))
+    width = (lines[..., 0].max() if len(lines) else mesh_size) * scale
+    height = (lines[..., 1].max() if len(lines) else mesh_size) * scale
+    for k in range(n_noise):
+        layer = NOISE_LAYERS[k % len(NOISE_LAYERS)]
+        x, y = rng.uniform(0, width), rng.uniform(0, height)
+        kind = k % 4
+        if kind == 0:
+            msp.add_line((x, y), (x + rng.uniform(-5, 5) * scale, y), dxfattribs={"layer": layer})
+        elif kind == 1:
+            msp.add_lwpolyline([(x, y), (x + scale, y), (x + scale, y + scale)], dxfattribs={"layer": layer})
+        elif kind == 2:
+            msp.add_circle((x, y), 0.5 * scale, dxfattribs={"layer": layer})
+        else:
+            msp.add_text(f"T{k}", dxfattribs={"layer": layer, "insert": (x, y)})
+
+    doc.saveas(path)
+    return {"segments": len(lines), "rods": len(rods), "noise": n_noise}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic grounding grid DXF file.")
+    parser.add_argument("output")
+    parser.add_argument("--shape", choices=SHAPES, default="rectangle")
+    parser.add_argument("--segments", type=int, default=200, help="Approximate number of cable segments.")
+    parser.add_argument("--mesh-size", type=float, default=7.0)
+    parser.add_argument("--rod-step", type=int, default=2)
+    parser.add_argument("--rod-density", type=float, default=0.0)
+    parser.add_argument("--noise", type=float, default=0.0, help="Non-grounding entities per grounding entity.")
+    parser.add_argument("--units", choices=("m", "mm"), default="m")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    nx, ny = lattice_for_segments(args.segments, args.shape)
+    written = write_grid_dxf(args.output, args.shape, nx, ny, args.mesh_size, args.rod_step, args.rod_density,
+                             args.noise, args.seed, args.units)
+    print(written)
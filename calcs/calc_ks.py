@@ -1,5 +1,49 @@
 import numpy as np
 
+def k_breakpoints(A):
+    """
+    Depths where the k1 and k2 curves are defined: 0, sqrt(A)/10 and sqrt(A)/6.
+    Compute them once per grid area and pass them to k1_array/k2_array.
+    """
+    return (0, 1/10*np.sqrt(A), 1/6*np.sqrt(A))
+
+def _interpolate_k(values, h, breakpoints):
+    """
+    Piecewise linear interpolation of k1/k2 with the same arithmetic as the scalar
+    versions: constant at or below h=0, linear between the breakpoints and linear
+    extrapolation beyond the last one.
+    """
+    h0, h1, h2 = breakpoints
+    v0, v1, v2 = values
+    h = np.asarray(h, dtype=float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        first = v0 + (v1 - v0) / (h1 - h0) * (h - h0)
+        second = v1 + (v2 - v1) / (h2 - h1) * (h - h1)
+        beyond = v2 + (v2 - v1) / (h2 - h1) * (h - h2)
+
+    return np.select([h <= h0, h >= h2, h <= h1], [np.broadcast_to(v0, first.shape), beyond, first], second)
+
+def k1_array(ratio, h, A, breakpoints=None):
+    """
+    Vectorised k1, ratio, h and A can be arrays that broadcast against each other.
+    """
+    ratio = np.asarray(ratio, dtype=float)
+    if breakpoints is None:
+        breakpoints = k_breakpoints(np.asarray(A, dtype=float))
+    values = (-0.04*ratio+1.41, -0.05*ratio+1.20, -0.05*ratio+1.13)
+    return _interpolate_k(values, h, breakpoints)
+
+def k2_array(ratio, h, A, breakpoints=None):
+    """
+    Vectorised k2, ratio, h and A can be arrays that broadcast against each other.
+    """
+    ratio = np.asarray(ratio, dtype=float)
+    if breakpoints is None:
+        breakpoints = k_breakpoints(np.asarray(A, dtype=float))
+    values = (0.15*ratio+5.5, 0.1*ratio+4.68, -0.05*ratio+4.4)
+    return _interpolate_k(values, h, breakpoints)
+
 def k1(ratio,h, A):
     # Difining known points to interpolation
     h_values=[0, 1/10*np.sqrt(A), 1/6*np.sqrt(A)]
@@ -7,7 +51,7 @@ def k1(ratio,h, A):
 
     # Handle vector input for h
     if isinstance(h, (list, np.ndarray)):
-        return [k1(ratio, hi, A) for hi in h]
+        return k1_array(ratio, h, A).tolist()
 
     # calculation for values at zero or below (it can't happen below)
     if h<=h_values[0]:
@@ -31,7 +75,7 @@ def k2(ratio,h, A):
 
     # Handle vector input for h
     if isinstance(h, (list, np.ndarray)):
-        return [k2(ratio, hi, A) for hi in h]
+        return k2_array(ratio, h, A).tolist()
 
     # calculation for values at zero or below (it can't happen below)
     if h<=h_values[0]:
@@ -5,16 +5,51 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from calcs.plotting_ks import plotting_ks
-from calcs.calc_ks import k1,k2
-
-def Resistance(ro,A ,Lc, depth, diameter, nrods, rod_length, rod_diam,side1,side2,side3,side4, D=0,shape="rectangle",case="Schwarz"):
-    
-    if D!=0:
+from calcs.calc_ks import k1,k2,k1_array,k2_array,k_breakpoints
+
+def _where(condition, x, y):
+    """
+    Element-wise selection that keeps scalar inputs as scalars.
+    """
+    if np.ndim(condition) == 0:
+        return x if condition else y
+    return np.where(condition, x, y)
+
+# Registry of the grounding resistance models, keyed by normalised name
+RESISTANCE_MODELS = {}
+
+def _model_key(case):
+    # "Simplified 1", "simplified1" and "SIMPLIFIED1" are the same model
+    return case.replace(" ", "").lower()
+
+def register_model(case):
+    """
+    Decorator adding a grounding resistance model to the registry.
+
+    The model receives the dictionary of shared terms built by grid_terms
+    (ro, A, Lc, Lt, depth, diameter, nrods, rod_length, rod_diam, ratio) and
+    returns the resistance in Ohms.
+    """
+    def decorator(model):
+        RESISTANCE_MODELS[_model_key(case)] = model
+        model.case = case
+        return model
+    return decorator
+
+def grid_terms(ro,A ,Lc, depth, diameter, nrods, rod_length, rod_diam,side1,side2,side3,side4, D=0,shape="rectangle"):
+    """
+    Calculate the terms shared by all the resistance models (conductor length, area,
+    side ratio and total length). Returns None for non-supported shapes.
+    """
+    # ro, depth, diameter, nrods, rod_length, rod_diam and D can be arrays that broadcast
+    D=np.asarray(D, dtype=float)
+    nrods=np.asarray(nrods, dtype=float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
         if shape=="L":
-            Lc=(side1/D+1)*side2+ (side2/D+1)*side1 +(side3/D+1)*side4 +(side4/D+1)*side3 -side2
+            Lc=_where(np.not_equal(D, 0), (side1/D+1)*side2+ (side2/D+1)*side1 +(side3/D+1)*side4 +(side4/D+1)*side3 -side2, Lc)
         elif shape=="rectangle":
-            Lc=(side1/D+1)*side2+ (side2/D+1)*side1 
+            Lc=_where(np.not_equal(D, 0), (side1/D+1)*side2+ (side2/D+1)*side1, Lc)
 
     #Calculating areas depending on the shape of the grid
     if shape=="L":
@@ -24,39 +59,90 @@ def Resistance(ro,A ,Lc, depth, diameter, nrods, rod_length, rod_diam,side1,side
     elif shape=="imported":
         pass
     else: 
-        return "Non-supported shape"
+        return None
     
-    #Calculating grid ratios
-    if side1 / side2 < 1:
+    #Calculating grid ratios, imported shapes have no sides (only Schwarz uses the ratio)
+    if side1 is None or side2 is None:
+        ratio = None
+    elif side1 / side2 < 1:
         ratio = side2 / side1
     else:
         ratio = side1 / side2
-        
-    #calculating different cases
-    if case=="simplified1":
-        return ro/4*np.sqrt(np.pi/A)
-    elif case=="simplified2":
-        Lt=Lc+nrods*rod_length
-        return ro/4*np.sqrt(np.pi/A)+ro/Lt
-    elif case=="Sverak":
-        Lt=Lc+nrods*rod_length
-        return ro*(1/Lt+(1+1/(1+depth*np.sqrt(20/A)))/np.sqrt(20*A))
-    elif case=="Schwarz":
-        ap=np.sqrt(diameter*depth)
+
+    return {"ro": ro, "A": A, "Lc": Lc, "Lt": Lc+nrods*rod_length, "depth": depth, "diameter": diameter,
+            "nrods": nrods, "rod_length": rod_length, "rod_diam": rod_diam, "ratio": ratio}
+
+@register_model("simplified1")
+def simplified1(t):
+    return t["ro"]/4*np.sqrt(np.pi/t["A"])
+
+@register_model("simplified2")
+def simplified2(t):
+    return t["ro"]/4*np.sqrt(np.pi/t["A"])+t["ro"]/t["Lt"]
+
+@register_model("Sverak")
+def sverak(t):
+    ro, A, Lt, depth = t["ro"], t["A"], t["Lt"], t["depth"]
+    return ro*(1/Lt+(1+1/(1+depth*np.sqrt(20/A)))/np.sqrt(20*A))
+
+@register_model("Schwarz")
+def schwarz(t):
+    ro, A, Lc, Lt, depth, ratio = t["ro"], t["A"], t["Lc"], t["Lt"], t["depth"], t["ratio"]
+    nrods, rod_length, rod_diam = t["nrods"], t["rod_length"], t["rod_diam"]
+    if ratio is None:
+        raise ValueError("The Schwarz model needs the sides of the grid (rectangle or L shape).")
+
+    ap=np.sqrt(t["diameter"]*depth)
+    if np.ndim(depth)==0:
         K1=k1(ratio,depth,A)
         K2=k2(ratio,depth,A)
-        if nrods!=0:
-            R1 = (ro/(np.pi*Lc))*(np.log(2*Lc/ap)+K1*Lc/np.sqrt(A)-K2)
-            R2= (ro/(2*np.pi*nrods*rod_length))*(np.log(4*rod_length/rod_diam/2)-1+(2*K1*rod_length)*((np.sqrt(nrods)-1)**2)/(np.sqrt(A)))
-            Rm=(ro/(np.pi*Lc))*(np.log(2*Lc/rod_length)+(K1*Lc)/np.sqrt(A)-K2+1)
-            Rpt=(R1*R2-Rm**2)/(R1+R2-2*Rm)
-            # print("R1=",R1)
-            # print("R2=",R2)
-            # print("RM=",Rm)
-        elif nrods==0:
-            Rpt = (ro/(np.pi*Lt))*(np.log(2*Lt/ap)+K1*Lt/np.sqrt(A)-K2)
+    else:
+        breakpoints=k_breakpoints(A)
+        K1=k1_array(ratio,depth,A,breakpoints)
+        K2=k2_array(ratio,depth,A,breakpoints)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        R1 = (ro/(np.pi*Lc))*(np.log(2*Lc/ap)+K1*Lc/np.sqrt(A)-K2)
+        R2= (ro/(2*np.pi*nrods*rod_length))*(np.log(4*rod_length/rod_diam/2)-1+(2*K1*rod_length)*((np.sqrt(nrods)-1)**2)/(np.sqrt(A)))
+        Rm=(ro/(np.pi*Lc))*(np.log(2*Lc/rod_length)+(K1*Lc)/np.sqrt(A)-K2+1)
+        # print("R1=",R1)
+        # print("R2=",R2)
+        # print("RM=",Rm)
+        Rpt=_where(np.not_equal(nrods, 0), (R1*R2-Rm**2)/(R1+R2-2*Rm),
+                   (ro/(np.pi*Lt))*(np.log(2*Lt/ap)+K1*Lt/np.sqrt(A)-K2))
+
+    return Rpt
+
+def Resistance(ro,A ,Lc, depth, diameter, nrods, rod_length, rod_diam,side1,side2,side3,side4, D=0,shape="rectangle",case="Schwarz"):
+    terms=grid_terms(ro, A, Lc, depth, diameter, nrods, rod_length, rod_diam, side1, side2, side3, side4, D, shape)
+    if terms is None:
+        return "Non-supported shape"
+
+    model=RESISTANCE_MODELS.get(_model_key(case))
+    if model is None:
+        raise ValueError(f"Unsupported grounding resistance model: {case}. Supported models are {list_models()}.")
+    return model(terms)
+
+def Resistance_all(ro,A ,Lc, depth, diameter, nrods, rod_length, rod_diam,side1,side2,side3,side4, D=0,shape="rectangle",cases=None):
+    """
+    Calculate the grounding resistance with several models at once, computing the shared
+    terms only once. Array inputs give arrays for every model.
+
+    Returns:
+        A dictionary {model name: resistance} with all the registered models, or the
+        ones listed in cases.
+    """
+    terms=grid_terms(ro, A, Lc, depth, diameter, nrods, rod_length, rod_diam, side1, side2, side3, side4, D, shape)
+    if terms is None:
+        raise ValueError(f"Non-supported shape: {shape}")
+
+    models=RESISTANCE_MODELS.values() if cases is None else [RESISTANCE_MODELS[_model_key(case)] for case in cases]
+    return {model.case: model(terms) for model in models}
 
-        return Rpt
+def list_models():
+    """
+    Names of the registered grounding resistance models.
+    """
+    return [model.case for model in RESISTANCE_MODELS.values()]
 
 
 if __name__ == '__main__':
@@ -75,6 +161,7 @@ if __name__ == '__main__':
     print("K_dos=",K_dos) 
 
     #replicating Ks plots:
+    # from calcs.plotting_ks import plotting_ks
     # plotting_ks((0,8),depth_vector,A)
 
     # Data to test the Rpt function using IEEE 80 Appendix B 
@@ -1,46 +1,116 @@
+import threading
+
 import numpy as np
-from scipy.spatial import ConvexHull
-from shapely.geometry import Polygon, Point
+import shapely
+from shapely.geometry import Polygon
+
+from instrumentation import stage
+
+# scipy and matplotlib are imported where they are used, importing them costs more
+# than a whole calculation
+
+class _lazy:
+    """
+    Geometry property computed on first access by one of the Geom_etry steps.
+
+    The properties listed in depends are resolved first, then the step method runs
+    and stores its results on the instance. Steps run under the lock of the instance
+    and their results are only read once the step has finished, so a geometry can be
+    shared between threads.
+    """
+    def __init__(self, step, depends=()):
+        self.step = step
+        self.depends = depends
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        if self.step not in obj._done_steps:
+            with obj._steps_lock:
+                # The step itself can read the values it has already set
+                if self.step not in obj._done_steps and self.step not in obj._running_steps:
+                    for dependency in self.depends:
+                        getattr(obj, dependency)
+                    obj._running_steps.add(self.step)
+                    try:
+                        with stage(self.step, "geometry"):
+                            getattr(obj, self.step)()
+                    finally:
+                        obj._running_steps.discard(self.step)
+                    obj._done_steps.add(self.step)
+        return obj.__dict__[self.name]
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
 
-import matplotlib.pyplot as plt
 
 class Geom_etry():
+    # Analysis steps and the properties they compute, with their dependencies
+    line_lengths = _lazy('lines_overall_length')
+    horizontal_lines = _lazy('sort_lines')
+    vertical_lines = _lazy('sort_lines')
+    hull = _lazy('polyg_one')
+    hull_polygon = _lazy('convex_hull_to_polygon', depends=('hull',))
+    horizontal_lengths = _lazy('largest_two_lines', depends=('horizontal_lines', 'vertical_lines'))
+    vertical_lengths = _lazy('largest_two_lines', depends=('horizontal_lines', 'vertical_lines'))
+    largest_horizontal = _lazy('largest_two_lines', depends=('horizontal_lines', 'vertical_lines'))
+    largest_vertical = _lazy('largest_two_lines', depends=('horizontal_lines', 'vertical_lines'))
+    shape = _lazy('is_rectangle_or_l_shape', depends=('hull', 'hull_polygon'))
+    side1 = _lazy('is_rectangle_or_l_shape', depends=('hull', 'hull_polygon'))
+    side2 = _lazy('is_rectangle_or_l_shape', depends=('hull', 'hull_polygon'))
+    side3 = _lazy('is_rectangle_or_l_shape', depends=('hull', 'hull_polygon'))
+    side4 = _lazy('is_rectangle_or_l_shape', depends=('hull', 'hull_polygon'))
+    polyg_on = _lazy('is_rectangle_or_l_shape', depends=('hull', 'hull_polygon'))
+    l_polygon = _lazy('is_rectangle_or_l_shape', depends=('hull', 'hull_polygon'))
+    area = _lazy('calculate_polygon_area', depends=('polyg_on',))
+    perimeter = _lazy('perimeter_covered', depends=('polyg_on',))
+    max_length_x = _lazy('max_lengths', depends=('polyg_on',))
+    max_length_y = _lazy('max_lengths', depends=('polyg_on',))
+    max_dist = _lazy('max_distance', depends=('polyg_on', 'hull'))
+    max_horizontal_separation = _lazy('largest_parallel_separation', depends=('horizontal_lines', 'vertical_lines'))
+    max_vertical_separation = _lazy('largest_parallel_separation', depends=('horizontal_lines', 'vertical_lines'))
+    max_separation = _lazy('largest_parallel_separation', depends=('horizontal_lines', 'vertical_lines'))
+    meshes = _lazy('find_meshes')
+    mesh_areas = _lazy('find_meshes')
+    mesh_dimensions = _lazy('find_meshes')
+    mesh_spacings = _lazy('find_meshes')
+    largest_mesh = _lazy('find_meshes')
+    mesh_separation = _lazy('find_meshes')
+    location_rods = _lazy('check_rods_location', depends=('polyg_on',))
+    rods_classification = _lazy('check_rods_location', depends=('polyg_on',))
+
     def __init__(self,lines_list, rods_list):
-        self.lines_list = lines_list
-        self.rods_list = rods_list
-        self.side1=None
-        self.side2=None
-        self.side3=None
-        self.side4=None
-        self.hull = None
-        self.area=None
-        self.line_lengths=None
-        self.horizontal_lines = []
-        self.vertical_lines = []
-        self.largest_horizontal = ()
-        self.largest_vertical = ()
-        self.lines_overall_length()
-        self.sort_lines()
-        self.polyg_one()
-        self.convex_hull_to_polygon()
-        self.largest_two_lines()
-        self.is_rectangle_or_l_shape()
-        self.calculate_polygon_area()
-        self.perimeter_covered()
-        self.max_lengths()
-        self.max_distance()
-        self.largest_parallel_separation()
-        self.check_rods_location()
+        # Lines as an (N, 2, 2) array and rods as an (M, 2) array, lists are converted
+        # The geometry properties are computed on first access
+        self.lines_list = np.asarray(lines_list, dtype=np.float64).reshape(-1, 2, 2)
+        self.rods_list = np.asarray(rods_list, dtype=np.float64).reshape(-1, 2)
+        self._steps_lock = threading.RLock()
+        self._done_steps = set()
+        self._running_steps = set()
+
+    def compute_all(self):
+        """
+        Run every analysis step, as it was done when building the object.
+        """
+        for name, attribute in vars(Geom_etry).items():
+            if isinstance(attribute, _lazy):
+                getattr(self, name)
+        return self
 
     # Calculate the overall length of all lines
     def lines_overall_length(self):
-        Lines_lengths = [float(line_length(line)) for line in self.lines_list]
-        self.line_lengths=sum(Lines_lengths)
+        d = self.lines_list[:, 1, :] - self.lines_list[:, 0, :]
+        self.line_lengths = float(np.hypot(d[:, 0], d[:, 1]).sum())
 
     # Defining the outer polygon covered by the lines 
     def polyg_one(self):
+        from scipy.spatial import ConvexHull
+
         # Extract all points from the lines
-        points = np.array([point for line in self.lines_list for point in line])
+        points = self.lines_list.reshape(-1, 2)
         
         # Compute the convex hull
         self.hull = ConvexHull(points)
@@ -51,36 +121,29 @@ class Geom_etry():
         """
         hull_points = np.roll(self.hull.points[self.hull.vertices], -1, axis=0)
         # print("hull_points",hull_points)
-        self.polyg_on= Polygon(hull_points)
+        self.hull_polygon= Polygon(hull_points)
 
     def sort_lines(self):
         # Sort horizontal and vertical lines from left to right and bottom to top
-        self.horizontal_lines = []
-        self.vertical_lines = []
+        # Horizontal lines are stored as rows (x_min, y, x_max) and vertical lines as (x, y_min, y_max)
+        x1, y1 = self.lines_list[:, 0, 0], self.lines_list[:, 0, 1]
+        x2, y2 = self.lines_list[:, 1, 0], self.lines_list[:, 1, 1]
+        is_horizontal = np.isclose(y1, y2)
+        is_vertical = np.isclose(x1, x2) & ~is_horizontal
 
-        for line in self.lines_list:
-            (x1, y1), (x2, y2) = line
-            if np.isclose(y1, y2):  # Horizontal line
-                self.horizontal_lines.append((min(x1, x2), y1, max(x1, x2)))
-            elif np.isclose(x1, x2):  # Vertical line
-                self.vertical_lines.append((x1, min(y1, y2), max(y1, y2)))
+        horizontal_lines = np.column_stack((np.minimum(x1, x2), y1, np.maximum(x1, x2)))[is_horizontal]
+        vertical_lines = np.column_stack((x1, np.minimum(y1, y2), np.maximum(y1, y2)))[is_vertical]
 
         # Sort lines by their x-y coordinate if they are horizontal or vertical
-        self.horizontal_lines.sort(key=lambda line: line[1])
-        self.vertical_lines.sort(key=lambda line: line[0])
+        self.horizontal_lines = horizontal_lines[np.argsort(horizontal_lines[:, 1], kind='stable')]
+        self.vertical_lines = vertical_lines[np.argsort(vertical_lines[:, 0], kind='stable')]
 
 
     def largest_two_lines(self):
     
-        # Calculate lengths of horizontal lines
-        self.horizontal_lengths = [line[2] - line[0] for line in self.horizontal_lines]
-
-        # Calculate lengths of vertical lines
-        self.vertical_lengths = [line[2] - line[1] for line in self.vertical_lines]
-
-        # Sort lengths in descending order
-        self.horizontal_lengths.sort(reverse=True)
-        self.vertical_lengths.sort(reverse=True)
+        # Calculate lengths of horizontal and vertical lines, sorted in descending order
+        self.horizontal_lengths = np.sort(self.horizontal_lines[:, 2] - self.horizontal_lines[:, 0])[::-1].tolist()
+        self.vertical_lengths = np.sort(self.vertical_lines[:, 2] - self.vertical_lines[:, 1])[::-1].tolist()
 
         # Find the two largest horizontal lengths
         self.largest_horizontal = [self.horizontal_lengths[0]] if self.horizontal_lengths else []
@@ -131,6 +194,12 @@ class Geom_etry():
         self.side4=self.largest_vertical[0]-self.largest_vertical[1]
 
     def is_rectangle_or_l_shape(self):
+        # Imported shape by default, the outer polygon is the convex hull
+        self.shape = "imported"
+        self.side1 = self.side2 = self.side3 = self.side4 = None
+        self.l_polygon = None
+        self.polyg_on = self.hull_polygon
+
         hull_points = self.hull.points[self.hull.vertices]
         num_vertices = len(hull_points)
         
@@ -164,7 +233,10 @@ class Geom_etry():
         
         right_angles = [angle for angle in angles if 80 <= angle <= 100 or 260 <= angle <= 280]
 
-        if len(right_angles) >= 2 and num_vertices != 4:
+        # The L polygon is built from the two longest conductors in each direction, drawings
+        # with conductors split in short segments (no two distinct lengths) stay "imported"
+        l_conductors = len(self.largest_horizontal) == 2 and len(self.largest_vertical) == 2
+        if len(right_angles) >= 2 and num_vertices != 4 and l_conductors:
             # Identify sides for L-shape
             side_lengths = [line_length((hull_points[i], hull_points[(i + 1) % num_vertices])) for i in range(num_vertices)]
             side_lengths.sort(reverse=True)
@@ -214,67 +286,70 @@ class Geom_etry():
 
     # Calculate the maximum distance between any two points in a Shapely Polygon.
     def max_distance(self):
-    
-        # Extract the exterior coordinates of the polygon
-        points = list(self.polyg_on.exterior.coords)
 
-        # Calculate the maximum distance between any two points
-        max_dist = 0
-        for i in range(len(points)):
-            for j in range(i + 1, len(points)):
-                dist = np.hypot(points[j][0] - points[i][0], points[j][1] - points[i][1])
-                if dist > max_dist:
-                    max_dist = dist
-        self.max_dist= max_dist
+        # The farthest points of a polygon are vertices of its convex hull
+        if self.polyg_on is self.l_polygon:
+            from scipy.spatial import ConvexHull
+            points = np.asarray(self.polyg_on.exterior.coords)
+            hull = ConvexHull(points)
+            hull_points = points[hull.vertices]
+        else:
+            hull_points = self.hull.points[self.hull.vertices]
+
+        self.max_dist = convex_diameter(hull_points)
 
     # Calculate the largest separation between parallel lines that are next to each other in the lines_list
     def largest_parallel_separation(self):
 
-        # Helper function to calculate the separation between two parallel lines
-        def separation_between_lines(line1, line2, is_horizontal):
-            if is_horizontal:
-                return abs(line1[1] - line2[1])  # Difference in y-coordinates
-            else:
-                return abs(line1[0] - line2[0])  # Difference in x-coordinates
+        # Find the largest separation between sorted horizontal lines (difference in y-coordinates)
+        horizontal_separations = np.diff(self.horizontal_lines[:, 1])
+        self.max_horizontal_separation = float(horizontal_separations.max()) if len(horizontal_separations) else 0.0
 
-        
-        # Find the largest separation between sorted horizontal lines
-        max_horizontal_separation = 0
-        for i in range(len(self.horizontal_lines) - 1):
-            separation = separation_between_lines(self.horizontal_lines[i], self.horizontal_lines[i + 1], is_horizontal=True)
-            self.max_horizontal_separation = max(max_horizontal_separation, separation)
-
-        # Find the largest separation between sorted vertical lines
-        max_vertical_separation = 0
-        for i in range(len(self.vertical_lines) - 1):
-            separation = separation_between_lines(self.vertical_lines[i], self.vertical_lines[i + 1], is_horizontal=False)
-            self.max_vertical_separation = max(max_vertical_separation, separation)
+        # Find the largest separation between sorted vertical lines (difference in x-coordinates)
+        vertical_separations = np.diff(self.vertical_lines[:, 0])
+        self.max_vertical_separation = float(vertical_separations.max()) if len(vertical_separations) else 0.0
 
         # Return the largest separation among parallel lines that are next to each other
         self.max_separation=max(self.max_horizontal_separation, self.max_vertical_separation)
 
+    # Find every closed mesh of the conductor network
+    def find_meshes(self):
+        self.meshes, self.mesh_areas, self.mesh_dimensions = extract_meshes(self.lines_list)
+
+        # The spacing of a mesh is its longer side, the worst case for the touch voltage
+        self.mesh_spacings = self.mesh_dimensions[:, 0]
+        if len(self.meshes):
+            self.largest_mesh = self.meshes[np.argmax(self.mesh_areas)]
+            self.mesh_separation = float(self.mesh_spacings.max())
+        else:
+            self.largest_mesh = None
+            self.mesh_separation = 0.0
+
     # Check if the points in the rods_list are located in or near the perimeter of the polygon.
-    def check_rods_location(self):
+    def check_rods_location(self, tolerance=3):
         
-        if not self.rods_list:
+        if len(self.rods_list) == 0:
+            self.rods_classification = np.array([], dtype='<U9')
             self.location_rods = "no"
             return self.location_rods
 
         if not self.polyg_on:
             raise ValueError("Polygon (polyg_on) has not been created yet.")
 
-        # Define a buffer around the polygon's perimeter with a tolerance of 3 meters
-        perimeter_buffer = self.polyg_on.buffer(3)
+        # Define a band around the polygon's perimeter with a tolerance of 3 meters
+        perimeter_band = self.polyg_on.exterior.buffer(tolerance)
+        shapely.prepare(perimeter_band)
+        shapely.prepare(self.polyg_on)
 
-        # Check each rod's location
-        rods_near_perimeter = 0
-        for rod in self.rods_list:
-            rod_point = Point(rod)
-            if perimeter_buffer.contains(rod_point):
-                rods_near_perimeter += 1
+        # Classify all the rods at once
+        x, y = self.rods_list[:, 0], self.rods_list[:, 1]
+        near_perimeter = shapely.contains_xy(perimeter_band, x, y)
+        inside = shapely.contains_xy(self.polyg_on, x, y)
+        self.rods_classification = np.where(near_perimeter, "perimeter",
+                                            np.where(inside, "interior", "outside"))
 
         # Determine the location of the rods
-        if rods_near_perimeter > 0:
+        if near_perimeter.any():
             self.location_rods = "perimeter"
         else:
             self.location_rods = "non_perimeter"
@@ -287,7 +362,80 @@ def line_length(line):
     return np.hypot(x2-x1, y2-y1)
 
 
+# Closed meshes of a conductor network
+def extract_meshes(lines, grid_size=1e-6):
+    """
+    Find every closed mesh formed by the conductors, including diagonal ones.
+
+    The lines are snapped to grid_size, noded at their crossings and polygonized, so
+    the cost grows as O(n log n) with the number of lines.
+
+    Args:
+        lines: (N, 2, 2) array or list of line segments.
+        grid_size: Snapping tolerance, in the units of the lines.
+
+    Returns:
+        meshes: Array of Shapely polygons, one per mesh.
+        areas: Area of every mesh.
+        dimensions: (K, 2) array with the long and short sides of the smallest
+                    rectangle enclosing every mesh.
+    """
+    lines = np.asarray(lines, dtype=np.float64).reshape(-1, 2, 2)
+    conductors = shapely.set_precision(shapely.linestrings(lines), grid_size) if len(lines) else np.array([])
+    conductors = conductors[~shapely.is_empty(conductors)]
+    if len(conductors) == 0:
+        return np.array([], dtype=object), np.zeros(0), np.zeros((0, 2))
+
+    # Split the conductors at every crossing and build the closed rings
+    noded = shapely.node(shapely.multilinestrings(conductors))
+    meshes = shapely.get_parts(shapely.polygonize(shapely.get_parts(noded)))
+    areas = shapely.area(meshes)
+    meshes, areas = meshes[areas > grid_size ** 2], areas[areas > grid_size ** 2]
+
+    # Sides of the minimum rotated rectangle of every mesh
+    corners = shapely.get_coordinates(shapely.oriented_envelope(meshes)).reshape(len(meshes), -1, 2)
+    side_a = np.hypot(*(corners[:, 1] - corners[:, 0]).T)
+    side_b = np.hypot(*(corners[:, 2] - corners[:, 1]).T)
+    dimensions = np.column_stack((np.maximum(side_a, side_b), np.minimum(side_a, side_b)))
+
+    return meshes, areas, dimensions
+
+# Diameter of a convex polygon
+def convex_diameter(hull_points):
+    """
+    Calculate the largest distance between the vertices of a convex polygon with
+    rotating calipers, in O(h) for h vertices given in counterclockwise order.
+    """
+    points = np.asarray(hull_points, dtype=np.float64).tolist()
+    n = len(points)
+    if n < 2:
+        return 0.0
+    if n == 2:
+        return float(np.hypot(points[1][0] - points[0][0], points[1][1] - points[0][1]))
+
+    # Twice the area of the triangle (a, b, c)
+    def area2(a, b, c):
+        return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+    max_dist2 = 0.0
+    j = 1
+    for i in range(n):
+        p1, p2 = points[i], points[(i + 1) % n]
+
+        # Move the opposite caliper to the farthest vertex from the edge p1-p2
+        while area2(p1, p2, points[(j + 1) % n]) > area2(p1, p2, points[j]):
+            j = (j + 1) % n
+
+        for p in (p1, p2):
+            dist2 = (points[j][0] - p[0]) ** 2 + (points[j][1] - p[1]) ** 2
+            if dist2 > max_dist2:
+                max_dist2 = dist2
+
+    return float(np.sqrt(max_dist2))
+
 def plot_polygon(hull, title):
+    import matplotlib.pyplot as plt
+
     hull_points = hull.points[hull.vertices]
     plt.figure()
     plt.plot(hull_points[:, 0], hull_points[:, 1], 'o')
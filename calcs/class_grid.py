@@ -3,9 +3,16 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from calcs.calc_rpt import Resistance
+from calcs.calc_rpt import Resistance, Resistance_all, _where
 
 class GroundingGrid:
+    """
+    Grounding grid factors, resistance and touch/step voltages (IEEE 80).
+
+    ro, cable_depth, cable_diameter, num_rods, rod_length, rod_diameter and D can be
+    NumPy arrays that broadcast against each other, to evaluate many design variants
+    of the same geometry at once (see evaluate).
+    """
     def __init__(self, ro, cable_depth, cable_diameter, num_rods, rod_length, rod_diameter,
                  case, location_rods, D, shape, side1, side2, side3, side4, A, Lc, Lp, Dm, Lx, Ly):
         self.ro = ro  # Soil resistivity (Ohm-m)
@@ -62,6 +69,40 @@ class GroundingGrid:
             case=self.case
         )
 
+    def Calc_Resistance_models(self, cases=None):
+        """
+        Calculate the grounding resistance (Ohms) with every registered model, or the
+        ones listed in cases, side by side.
+        """
+        self.Rpt_models=Resistance_all(
+            ro=self.ro,
+            A=self.A,
+            Lc=self.Lc,
+            depth=self.cable_depth,
+            diameter=self.cable_diameter,
+            nrods=self.num_rods,
+            rod_length=self.rod_length,
+            rod_diam=self.rod_diameter,
+            side1=self.side1,
+            side2=self.side2,
+            side3=self.side3,
+            side4=self.side4,
+            D=self.D,
+            shape=self.shape,
+            cases=cases
+        )
+        return self.Rpt_models
+
+    def evaluate(self, current):
+        """
+        Calculate the grounding resistance, touch and step voltages in one call.
+        The current (Amps) can also be an array broadcasting against the grid inputs.
+
+        Returns:
+            Rg, Em, Es: Arrays with the broadcast shape of all the inputs.
+        """
+        return np.broadcast_arrays(self.Rpt, self.Em(current), self.Es(current))
+
     def Em(self, current):
         """
         Calculate the touch potential (Volts).
@@ -122,10 +163,11 @@ class GroundingGrid:
         """
         Calculate the Lm factor based on the grid parameters.
         """
-        if self.location_rods!="perimeter" or self.num_rods==0:
+        if self.location_rods!="perimeter":
             self.Lm=self.Lc + self.LR
-        elif self.location_rods=="perimeter":
-            self.Lm=self.Lc+(self.LR)*(1.55+1.22*(self.rod_length/np.hypot(self.Lx,self.Ly)))
+        else:
+            self.Lm=_where(np.equal(self.num_rods, 0), self.Lc + self.LR,
+                           self.Lc+(self.LR)*(1.55+1.22*(self.rod_length/np.hypot(self.Lx,self.Ly))))
 
     def calc_Ks(self):
         """
@@ -0,0 +1,66 @@
+from dataclasses import dataclass, fields, astuple
+
+import numpy as np
+
+
+@dataclass(frozen=True, slots=True)
+class GroundGridResult:
+    """
+    Results of a grounding grid calculation (IEEE 80), as raw numbers in SI units.
+
+    Formatting for the GUI and the reports is done by outputs.format_results.
+    """
+    selected_cable: str  # Selected cable size
+    cable_area: float  # Minimum conductor area (kcmil)
+    cable_diameter: float  # Diameter of the selected cable (mm)
+    short_circuit_conductor: float  # Short circuit for the conductor sizing (kA)
+    short_circuit: float  # Short circuit for the GPR (kA)
+    grid_current: float  # Current through the grid (A)
+    resistance: float  # Grounding resistance (Ohms)
+    gpr: float  # Ground Potential Rise (V)
+    tolerable_touch: float  # Tolerable touch voltage (V)
+    tolerable_step: float  # Tolerable step voltage (V)
+    touch_voltage: float  # Mesh (touch) voltage (V)
+    step_voltage: float  # Step voltage (V)
+    D: float  # Mesh size used in the calculation (m)
+    n: float  # Geometric factor
+    Km: float  # Spacing factor for mesh voltage
+    Ki: float  # Irregularity factor
+    Ks: float  # Spacing factor for step voltage
+    Lm: float  # Effective buried length for mesh voltage (m)
+    Ls: float  # Effective buried length for step voltage (m)
+
+    @property
+    def gpr_below_tolerables(self):
+        # The touch and step voltages do not need to be checked
+        return not (self.gpr > self.tolerable_touch and self.gpr > self.tolerable_step)
+
+    @property
+    def touch_compliant(self):
+        return self.gpr_below_tolerables or self.touch_voltage <= self.tolerable_touch
+
+    @property
+    def step_compliant(self):
+        return self.gpr_below_tolerables or self.step_voltage <= self.tolerable_step
+
+    @property
+    def compliant(self):
+        return self.touch_compliant and self.step_compliant
+
+
+# Numeric fields of GroundGridResult, as stacked by stack_results
+NUMERIC_FIELDS = [field.name for field in fields(GroundGridResult) if field.type is float]
+
+
+def stack_results(results):
+    """
+    Stack several GroundGridResult into a structured NumPy array, with one float
+    column per numeric field and the compliance flag.
+    """
+    dtype = [(name, np.float64) for name in NUMERIC_FIELDS] + [("compliant", np.bool_)]
+    positions = [i for i, field in enumerate(fields(GroundGridResult)) if field.name in NUMERIC_FIELDS]
+    rows = []
+    for result in results:
+        values = astuple(result)
+        rows.append(tuple(values[i] for i in positions) + (result.compliant,))
+    return np.array(rows, dtype=dtype)
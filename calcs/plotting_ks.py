@@ -1,18 +1,15 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
-from .calc_ks import k1,k2,calc_kii
+from .calc_ks import k1,k2,k1_array,k2_array,k_breakpoints,calc_kii
 
 def plotting_ks(ratio_lim,depth_vector,A):
     ratio_values=np.linspace(ratio_lim[0],ratio_lim[1],100)
 
-    k1_results={depth:[] for depth in depth_vector}
-    k2_results={depth:[] for depth in depth_vector}
-
-    for ratio in ratio_values:
-        for depth in depth_vector:
-            k1_results[depth].append(k1(ratio,depth,A))
-            k2_results[depth].append(k2(ratio,depth,A))
+    # Evaluate every ratio at once for each depth
+    breakpoints=k_breakpoints(A)
+    k1_results={depth:k1_array(ratio_values,depth,A,breakpoints) for depth in depth_vector}
+    k2_results={depth:k2_array(ratio_values,depth,A,breakpoints) for depth in depth_vector}
 
     colors = ['blue', 'red', 'orange', 'green', 'purple', 'brown', 'pink', 'gray']
 
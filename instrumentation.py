@@ -0,0 +1,212 @@
+"""
+Timing and profiling of the calculation stages.
+
+The parser, the geometry, the kernel stages, the plots and the report are wrapped in
+stage(name) blocks. Nothing is measured unless a Recorder is active:
+
+    with recording() as recorder:
+        ground_grid(...)
+    print(recorder.summary_table())
+    recorder.write_chrome_trace("trace.json")  # open in chrome://tracing or Perfetto
+
+With no recorder, stage() only checks two variables and returns a shared no-op
+context manager.
+"""
+import atexit
+import contextlib
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+class Recorder:
+    """
+    Collects the (monotonic) timings of the stages run while it is active.
+
+    Args:
+        profile: Also run cProfile over the whole recording block.
+        callbacks: Functions called as callback(name, category, seconds) after
+                   every stage, e.g. to feed a log or a metrics system.
+    """
+    def __init__(self, profile=False, callbacks=()):
+        self.profile = profile
+        self.callbacks = list(callbacks)
+        self.events = []
+        self.origin_ns = time.perf_counter_ns()
+        self.profiler = cProfile.Profile() if profile else None
+        self._lock = threading.Lock()
+
+    def add(self, name, category, start_ns, end_ns):
+        event = {"name": name, "category": category, "start_ns": start_ns - self.origin_ns,
+                 "duration_ns": end_ns - start_ns, "pid": os.getpid(), "thread": threading.get_ident()}
+        with self._lock:
+            self.events.append(event)
+        for callback in self.callbacks:
+            callback(name, category, event["duration_ns"] / 1e9)
+
+    @contextlib.contextmanager
+    def stage(self, name, category="kernel"):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, time.perf_counter_ns())
+
+    def summary(self):
+        """
+        Count, total, mean and maximum time (seconds) of every stage, slowest first.
+        """
+        stats = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            row = stats.setdefault((event["category"], event["name"]), [0, 0, 0])
+            row[0] += 1
+            row[1] += event["duration_ns"]
+            row[2] = max(row[2], event["duration_ns"])
+        rows = [{"category": category, "name": name, "count": count, "total": total / 1e9,
+                 "mean": total / count / 1e9, "max": longest / 1e9}
+                for (category, name), (count, total, longest) in stats.items()]
+        return sorted(rows, key=lambda row: row["total"], reverse=True)
+
+    def summary_table(self):
+        return format_summary(self.summary())
+
+    def to_json(self):
+        with self._lock:
+            events = list(self.events)
+        return {"events": events, "summary": self.summary()}
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=1)
+
+    def to_chrome_trace(self):
+        """
+        The events in the Chrome trace event format (complete events, microseconds).
+        """
+        with self._lock:
+            events = list(self.events)
+        return {"traceEvents": [{"name": event["name"], "cat": event["category"], "ph": "X",
+                                 "ts": event["start_ns"] / 1e3, "dur": event["duration_ns"] / 1e3,
+                                 "pid": event["pid"], "tid": event["thread"]} for event in events],
+                "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def profile_stats(self):
+        """
+        pstats.Stats of the cProfile capture (profile=True only).
+        """
+        if self.profiler is None:
+            raise ValueError("The recorder was created without profile=True.")
+        return pstats.Stats(self.profiler)
+
+    def write_profile(self, path):
+        self.profile_stats().dump_stats(path)
+
+
+def format_summary(rows):
+    """
+    Text table of the rows given by Recorder.summary.
+    """
+    lines = [f"{'stage':<36} {'count':>7} {'total (ms)':>11} {'mean (ms)':>10} {'max (ms)':>10}"]
+    for row in rows:
+        name = f"{row['category']}.{row['name']}"
+        lines.append(f"{name:<36} {row['count']:>7} {row['total'] * 1e3:11.2f} "
+                     f"{row['mean'] * 1e3:10.3f} {row['max'] * 1e3:10.3f}")
+    return "\n".join(lines)
+
+
+# Recorder of the current context (thread or async task), and the one set for the
+# whole process with enable(), e.g. by the GUI
+_current = contextvars.ContextVar("grounding_recorder", default=None)
+_process_recorder = None
+_disabled = contextlib.nullcontext()
+
+
+def stage(name, category="kernel"):
+    """
+    Context manager timing a stage in the active recorder, if there is one.
+    """
+    recorder = _current.get() or _process_recorder
+    if recorder is None:
+        return _disabled
+    return recorder.stage(name, category)
+
+def timed(name=None, category="gui"):
+    """
+    Decorator timing every call of a function as a stage.
+    """
+    def decorator(function):
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextlib.contextmanager
+def recording(profile=False, callbacks=(), recorder=None):
+    """
+    Record the stages run inside the block (in this thread or async task).
+    """
+    recorder = recorder or Recorder(profile=profile, callbacks=callbacks)
+    token = _current.set(recorder)
+    if recorder.profiler is not None:
+        recorder.profiler.enable()
+    try:
+        yield recorder
+    finally:
+        if recorder.profiler is not None:
+            recorder.profiler.disable()
+        _current.reset(token)
+
+def enable(recorder=None):
+    """
+    Record the stages of every thread of the process, until disable() is called.
+    Without a recorder, the one already enabled is kept.
+    """
+    global _process_recorder
+    if recorder is not None or _process_recorder is None:
+        _process_recorder = recorder or Recorder()
+    return _process_recorder
+
+def disable():
+    global _process_recorder
+    _process_recorder = None
+
+def enable_from_environment(variable="GROUNDING_TIMINGS"):
+    """
+    Enable the process recorder when the environment variable names a JSON file.
+    The recording is saved there, and its summary printed, when the process exits.
+    """
+    path = os.environ.get(variable)
+    if not path or _process_recorder is not None:
+        return _process_recorder
+
+    recorder = enable()
+
+    def save():
+        recorder.write_json(path)
+        print(recorder.summary_table(), file=sys.stderr)
+    atexit.register(save)
+    return recorder
+
+
+if __name__ == "__main__":
+    # Print the summary table of a recording saved with Recorder.write_json
+    if len(sys.argv) != 2:
+        sys.exit("usage: python instrumentation.py timings.json")
+    with open(sys.argv[1]) as f:
+        print(format_summary(json.load(f)["summary"]))
@@ -1,150 +1,355 @@
-import sys
-
-from parser.parser import process_dxf, convert_units
+import hashlib
+import itertools
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from parser.cache import load_geometry, file_sha256
 from calcs.calc_cable_size import cable_sizing
 from calcs.calc_tolerables import surface_correction, Etouch, Estep
 from calcs.calc_gpr import gpr
-from plots.plots import plot_grid_with_lines_and_rods
 
 from calcs.class_grid import GroundingGrid
 from calcs.class_geom_etry import Geom_etry
+from calcs.class_result import GroundGridResult
+from outputs.format_results import format_results
+from instrumentation import stage
 
-G_grid=None
-Geo_Grid=None
-
-
-# Defining Main calculation function
 
-def ground_grid(filepath, fileunits,conductor_type, short_circuit_conductor,short_circuit, fault_duration, person_weight, cable_depth,
-                depth_crushed_rock, ro, ros, ambient_temperature, split_factor, rod_length, rod_diameter, case, override_mesh, parallel_separ, nrods=None):
-    
-    # Parse the DXF file to get the lines and rods
-    lines_list_raw, rods_list_raw = process_dxf(filepath)
+# Calculation stages of ground_grid. They only depend on their arguments, and their
+# results are shared through the memo so they are never modified afterwards
 
-    # Scale the lines and rods
-    lines_list, rods_list =convert_units(lines_list_raw, rods_list_raw, fileunits)
+def _stage_parse(filepath, fileunits):
+    lines_list, rods_list = load_geometry(filepath, fileunits)
+    lines_list.setflags(write=False)
+    rods_list.setflags(write=False)
+    return lines_list, rods_list
 
-    # Calculate the effective short-circuit current
-    effective_short_circuit = short_circuit * split_factor  # Adjusting for the split factor
+def _stage_geometry(parse):
+    lines_list, rods_list = parse
+    return Geom_etry(lines_list, rods_list)
 
-    # Instantiate the Geom_etry class
-    Geo_Grid = Geom_etry(lines_list,rods_list)
-    
-    # Calculate the selected cable and cable diameter
-    cable_area,selected_cable, cable_diameter=cable_sizing(conductor_type, short_circuit_conductor, fault_duration, 
-                                                ambient_temperature)
-    
+def _stage_mesh_size(geometry, override_mesh, parallel_separ):
     # Check if the mesh Size wants to be overrrided
     if override_mesh:
-        D=parallel_separ
+        return parallel_separ
+    elif len(geometry.meshes):
+        return geometry.mesh_separation
     else:
-        D=Geo_Grid.max_separation
-
-
-    # Call the debugging function for inputs
-    # debug_inputs_ground_grid(filepath, lines_list_raw, rods_list_raw, lines_list, rods_list, Geo_Grid, cable_area, selected_cable, cable_diameter, rod_length, effective_short_circuit)     
-    # Plot to debug the geometry
-    # poly = Geo_Grid.polyg_on
-    # plot_grid_with_lines_and_rods(filepath, fileunits, poly, title="Grounding Grid with Lines and Rods")
+        return geometry.max_separation
+
+def _stage_grid(geometry, parse, cable, mesh_size, ro, cable_depth, rod_length, rod_diameter, case):
+    _, rods_list = parse
+    _, _, cable_diameter = cable
+    return GroundingGrid(ro, cable_depth, cable_diameter/1000, len(rods_list), rod_length, rod_diameter,
+                         case=case, location_rods=geometry.location_rods, D=mesh_size, shape=geometry.shape,
+                         side1=geometry.side1, side2=geometry.side2, side3=geometry.side3, side4=geometry.side4,
+                         A=geometry.area, Lc=geometry.line_lengths, Lp=geometry.perimeter, Dm=geometry.max_dist,
+                         Lx=geometry.max_length_x, Ly=geometry.max_length_y)
+
+def _stage_tolerable(surface, ros, fault_duration, person_weight):
+    tolerable_touch = float(Etouch(ros, surface, fault_duration, weight=person_weight))
+    tolerable_step = float(Estep(ros, surface, fault_duration, weight=person_weight))
+    return tolerable_touch, tolerable_step
+
+def _stage_voltages(grid, short_circuit, split_factor):
+    # Calculate the effective short-circuit current
+    effective_short_circuit = short_circuit * split_factor  # Adjusting for the split factor
 
-    # # TODO: Hide this, applicable only for benchmarking purposes
-    # cable_diameter=10
+    # Calculate the grounding grid resistance and the Ground Potential Rise (GPR)
+    Rg = float(grid.Rpt)
+    gpr_value = float(gpr(Rg, effective_short_circuit*1000))
 
-    # Instantiate the GroundingGrid class
-    G_grid = GroundingGrid(ro, cable_depth, cable_diameter/1000, len(rods_list), rod_length, rod_diameter,
-                           case=case, location_rods=Geo_Grid.location_rods, D=D, shape=Geo_Grid.shape,
-                            side1=Geo_Grid.side1, side2=Geo_Grid.side2, side3=Geo_Grid.side3, side4=Geo_Grid.side4,
-                            A=Geo_Grid.area, Lc=Geo_Grid.line_lengths,Lp=Geo_Grid.perimeter, Dm=Geo_Grid.max_dist,
-                            Lx=Geo_Grid.max_length_x, Ly=Geo_Grid.max_length_y)
+    # Calculate the touch and step potentials
+    touch_potential = float(grid.Em(effective_short_circuit*1000))
+    step_potential = float(grid.Es(effective_short_circuit*1000))
+
+    return effective_short_circuit, Rg, gpr_value, touch_potential, step_potential
+
+def _stage_results(cable, grid, mesh_size, voltages, tolerable, short_circuit_conductor, short_circuit):
+    cable_area, selected_cable, cable_diameter = cable
+    effective_short_circuit, Rg, gpr_value, touch_potential, step_potential = voltages
+    tolerable_touch, tolerable_step = tolerable
+
+    return GroundGridResult(
+        selected_cable=selected_cable, cable_area=float(cable_area), cable_diameter=float(cable_diameter),
+        short_circuit_conductor=float(short_circuit_conductor), short_circuit=float(short_circuit),
+        grid_current=float(effective_short_circuit * 1000), resistance=Rg, gpr=gpr_value,
+        tolerable_touch=tolerable_touch, tolerable_step=tolerable_step,
+        touch_voltage=touch_potential, step_voltage=step_potential, D=float(mesh_size),
+        n=float(grid.n), Km=float(grid.km), Ki=float(grid.ki), Ks=float(grid.ks), Lm=float(grid.Lm), Ls=float(grid.Ls))
+
+# Stage name -> (function, inputs). Inputs are ground_grid arguments or upstream stages,
+# a stage only reruns when one of its inputs changes.
+STAGES = OrderedDict([
+    ("parse", (_stage_parse, ("filepath", "fileunits"))),
+    ("geometry", (_stage_geometry, ("parse",))),
+    ("cable", (cable_sizing, ("conductor_type", "short_circuit_conductor", "fault_duration", "ambient_temperature"))),
+    ("mesh_size", (_stage_mesh_size, ("geometry", "override_mesh", "parallel_separ"))),
+    ("grid", (_stage_grid, ("geometry", "parse", "cable", "mesh_size", "ro", "cable_depth", "rod_length",
+                            "rod_diameter", "case"))),
+    ("surface", (surface_correction, ("ro", "ros", "depth_crushed_rock"))),
+    ("tolerable", (_stage_tolerable, ("surface", "ros", "fault_duration", "person_weight"))),
+    ("voltages", (_stage_voltages, ("grid", "short_circuit", "split_factor"))),
+    ("results", (_stage_results, ("cable", "grid", "mesh_size", "voltages", "tolerable", "short_circuit_conductor", "short_circuit"))),
+])
+
+# Stages computed from the drawing, directly or through an upstream stage
+DRAWING_STAGES = set()
+for _name, (_, _inputs) in STAGES.items():
+    if "filepath" in _inputs or DRAWING_STAGES.intersection(_inputs):
+        DRAWING_STAGES.add(_name)
+
+
+class GroundGridPipeline:
+    """
+    Staged ground_grid calculation with content-keyed memoisation.
+
+    Every stage is keyed by its name, the values of its inputs and the keys of its
+    upstream stages (the DXF file is keyed by its SHA-256), so after an input change
+    only the stages downstream of it are recomputed. The memo keeps the max_entries
+    most recently used stage results. A pipeline can be shared by several threads: a
+    stage already being computed by another thread is waited for, not computed again.
+    forget() drops the stages of a drawing, e.g. once a cache holding them lets it go.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._memo = OrderedDict()
+        self._file_hashes = {}
+        self._drawings = {}
+        self._computing = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def file_key(self, filepath):
+        """
+        SHA-256 of a file, computed again only when the file changed on disk.
+        """
+        stat = os.stat(filepath)
+        path = os.path.abspath(filepath)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            known = self._file_hashes.get(path)
+        if known is not None and known[0] == signature:
+            return known[1]
+        digest = file_sha256(filepath)
+        with self._lock:
+            self._file_hashes[path] = (signature, digest)
+        return digest
+
+    def run(self, progress=None, until="results", **inputs):
+        """
+        Run the stages needed for the results, reusing the memoised ones.
+        The list of (stage, "computed" | "cached") is left in self.trace, per thread.
 
-    # Calculate the grounding grid resistance
-    Rg=float(G_grid.Rpt)
+        progress(stage) is called before every stage. An exception raised by it stops
+        the run, e.g. to cancel a calculation whose inputs are out of date.
 
-    # Calculate the Ground Potential Rise (GPR)
-    gpr_value = float(gpr(Rg, effective_short_circuit*1000))
+        With until, the run stops after that stage and returns its value; only the
+        inputs of the stages up to it are needed (filepath and fileunits for "parse"
+        and "geometry").
+        """
+        keys = {}
+        values = {}
+        trace = []
+
+        for name, (function, stage_inputs) in STAGES.items():
+            if until in values:
+                break
+            if progress is not None:
+                progress(name)
+
+            key_parts = [name]
+            for item in stage_inputs:
+                if item in STAGES:
+                    key_parts.append(keys[item])
+                elif item == "filepath":
+                    key_parts.append(self.file_key(inputs[item]))
+                else:
+                    key_parts.append(repr(inputs[item]))
+            keys[name] = hashlib.sha256("|".join(key_parts).encode()).hexdigest()
+
+            while True:
+                with self._lock:
+                    found = keys[name] in self._memo
+                    if found:
+                        self._memo.move_to_end(keys[name])
+                        values[name] = self._memo[keys[name]]
+                        break
+                    computing = self._computing.get(keys[name])
+                    if computing is None:
+                        self._computing[keys[name]] = threading.Event()
+                        break
+                # Another thread computes this stage, its result is taken from the memo
+                # (or the stage computed here if that thread failed)
+                computing.wait()
+            if found:
+                trace.append((name, "cached"))
+                continue
+
+            args = [values[item] if item in STAGES else inputs[item] for item in stage_inputs]
+            try:
+                with stage(name, "kernel"):
+                    values[name] = function(*args)
+                trace.append((name, "computed"))
+                drawing = (self.file_key(inputs["filepath"]), inputs["fileunits"]) if name in DRAWING_STAGES else None
+                with self._lock:
+                    self._memo[keys[name]] = values[name]
+                    if drawing is not None:
+                        self._drawings[keys[name]] = drawing
+                    while len(self._memo) > self.max_entries:
+                        oldest, _ = self._memo.popitem(last=False)
+                        self._drawings.pop(oldest, None)
+            finally:
+                with self._lock:
+                    self._computing.pop(keys[name]).set()
+
+        self._local.trace = trace
+        return values[until]
+
+    @property
+    def trace(self):
+        # Trace of the last run of the calling thread
+        return getattr(self._local, "trace", [])
+
+    def recomputed(self):
+        """
+        Names of the stages computed (not taken from the memo) in the last run.
+        """
+        return [name for name, status in self.trace if status == "computed"]
 
-    # Calculate the surface correction factor
-    Cs = surface_correction(ro, ros, depth_crushed_rock)
+    def forget(self, file_key, fileunits):
+        """
+        Drop the memoised stages computed from a drawing, given its file_key and units.
+        Returns the number of stage results dropped.
+        """
+        with self._lock:
+            keys = [key for key, drawing in self._drawings.items() if drawing == (file_key, fileunits)]
+            for key in keys:
+                self._memo.pop(key, None)
+                del self._drawings[key]
+        return len(keys)
 
-    # Calculate tolerable values
-    tolerable_touch = float(Etouch(ros, Cs, fault_duration, weight=person_weight))
-    tolerable_step = float(Estep(ros, Cs, fault_duration, weight=person_weight))
+    def clear(self):
+        with self._lock:
+            self._memo.clear()
+            self._drawings.clear()
+            self._file_hashes.clear()
 
-    touch_status=""
-    step_status=""
 
-    # Compare the calculated GPR with the tolerable values
-    if gpr_value > tolerable_touch and gpr_value > tolerable_step:
-        pass
-    else:
-        touch_status="GPR is below the touch and step tolerable limits."
-        step_status="GPR is below the touch and step tolerable limits."
-        compliance=True
-        # print(touch_status)
-        results = {
-        "Selected Cable": f"{selected_cable}",
-        "Cable Diameter": f"{round(cable_diameter, 2)} mm",
-        "Conductor Short Circuit": f"{round(short_circuit_conductor, 2)} kA",
-        "Short Circuit Current": f"{round(short_circuit, 2)} kA",
-        "Current through the grid": f"{round(effective_short_circuit * 1000, 2)} A",
-        "Grounding Resistance": f"{round(Rg, 2)} Ohms",
-        "GPR": f"{round(gpr_value, 2)} V",
-        "Tolerable Touch Voltage": f"{round(tolerable_touch, 2)} V",
-        "Tolerable Step Voltage": f"{round(tolerable_step, 2)} V",
-        "Compliance": compliance,
-        "Step Status": step_status,
-        "Touch Status": touch_status,
-        }
-        return results
-        sys.exit(0)
+# Pipeline shared by the ground_grid calls
+default_pipeline = GroundGridPipeline()
 
 
-    # Calculate the touch and step potentials
-    touch_potential = float(G_grid.Em(effective_short_circuit*1000))  
-    step_potential = float(G_grid.Es(effective_short_circuit*1000))
+# Defining Main calculation function
 
-    # Call the output debugging function
-    # debug_outputs_ground_grid(G_grid, Rg, touch_potential, step_potential, tolerable_touch, tolerable_step, gpr_value)
-    
-    # Print the results
-    if touch_potential > tolerable_touch:
-        touch_status="Warning: Touch potential exceeds tolerable limits!"
-        compliance=False
-    else:
-        touch_status="Touch potential is within tolerable limits."
-        compliance=True
-    # print(touch_status)
+def ground_grid(filepath, fileunits,conductor_type, short_circuit_conductor,short_circuit, fault_duration, person_weight, cable_depth,
+                depth_crushed_rock, ro, ros, ambient_temperature, split_factor, rod_length, rod_diameter, case, override_mesh, parallel_separ, nrods=None,
+                pipeline=None, progress=None):
+    """
+    Calculate the grounding grid of a DXF drawing (IEEE 80).
 
-    if step_potential > tolerable_step:
-        step_status="Warning: Step potential exceeds tolerable limits!"
-        compliance=False
-    else:
-        step_status="Step potential is within tolerable limits."
-    # print(step_status)
+    Returns:
+        A GroundGridResult with the raw values; outputs.format_results gives the text version.
 
-    
+    The calculation runs through a GroundGridPipeline (default_pipeline unless one is
+    given), so repeated calls only recompute the stages affected by the changed inputs.
+    progress(stage) is called before every stage, see GroundGridPipeline.run.
+    """
+    if pipeline is None:
+        pipeline = default_pipeline
+
+    return pipeline.run(progress=progress, filepath=filepath, fileunits=fileunits, conductor_type=conductor_type,
+                        short_circuit_conductor=short_circuit_conductor, short_circuit=short_circuit,
+                        fault_duration=fault_duration, person_weight=person_weight, cable_depth=cable_depth,
+                        depth_crushed_rock=depth_crushed_rock, ro=ro, ros=ros, ambient_temperature=ambient_temperature,
+                        split_factor=split_factor, rod_length=rod_length, rod_diameter=rod_diameter, case=case,
+                        override_mesh=override_mesh, parallel_separ=parallel_separ)
+
+# Batch calculation of many scenarios
+
+def _run_chunk(chunk, return_exceptions=False):
+    # Runs in the worker processes, the pipeline of each worker keeps the parsed drawings
+    results = []
+    for index, scenario in chunk:
+        try:
+            results.append((index, ground_grid(**scenario)))
+        except Exception as error:
+            if not return_exceptions:
+                raise
+            results.append((index, error))
+    return results
 
-    results = {
-        "Selected Cable": f"{selected_cable}",
-        "Cable Diameter": f"{round(cable_diameter, 2)} mm",
-        "Conductor Short Circuit": f"{round(short_circuit_conductor, 2)} kA",
-        "Short Circuit Current": f"{round(short_circuit, 2)} kA",
-        "Current through the grid": f"{round(effective_short_circuit * 1000, 2)} A",
-        "Grounding Resistance": f"{round(Rg, 2)} Ohms",
-        "GPR": f"{round(gpr_value, 2)} V",
-        "Tolerable Touch Voltage": f"{round(tolerable_touch, 2)} V",
-        "Tolerable Step Voltage": f"{round(tolerable_step, 2)} V",
-        "Touch Voltage": f"{round(touch_potential, 2)} V",
-        "Step Potential": f"{round(step_potential, 2)} V",
-        "Compliance": compliance,
-        "Step Status": step_status,
-        "Touch Status": touch_status
-    }
-
-    # Formatting the results for better readability
+def _scenario_chunks(scenarios, chunksize, window):
+    # Read a window of scenarios at a time, group them by drawing and cut the groups in chunks
+    numbered = enumerate(scenarios)
+    while True:
+        block = list(itertools.islice(numbered, window))
+        if not block:
+            return
+        groups = {}
+        for index, scenario in block:
+            groups.setdefault((scenario["filepath"], scenario["fileunits"]), []).append((index, scenario))
+        for group in groups.values():
+            for start in range(0, len(group), chunksize):
+                yield group[start:start + chunksize]
+
+def _in_order(pairs, start=0):
+    # Hold back the results that arrive before the previous ones
+    pending = {}
+    next_index = start
+    for index, result in pairs:
+        pending[index] = result
+        while next_index in pending:
+            yield next_index, pending.pop(next_index)
+            next_index += 1
+
+def _run_pool(chunks, workers, return_exceptions):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Keep a couple of chunks per worker in flight, not the whole study
+        running = set()
+        for chunk in chunks:
+            running.add(pool.submit(_run_chunk, chunk, return_exceptions))
+            if len(running) >= 2 * workers:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+def ground_grid_many(scenarios, workers=None, chunksize=64, ordered=True, return_exceptions=False):
+    """
+    Run ground_grid over an iterable of scenarios, using a pool of processes.
+
+    Args:
+        scenarios: Iterable of dictionaries with the ground_grid arguments. It is read
+                   lazily, so it can be a generator over a very large study.
+        workers: Number of processes, all the CPUs by default. With 1 the scenarios run
+                 in this process.
+        chunksize: Number of scenarios sent to a worker at once. The scenarios of the
+                   same drawing are kept together so it is parsed once per worker.
+        ordered: Give the results in the order of the scenarios, otherwise as soon as
+                 they are completed.
+        return_exceptions: Give the exception raised by a scenario in place of its
+                           result instead of stopping the batch.
+
+    Yields:
+        (index, result) tuples, index being the position of the scenario in the input.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = _scenario_chunks(scenarios, chunksize, window=chunksize * workers * 4)
 
+    if workers == 1:
+        completed = (pair for chunk in chunks for pair in _run_chunk(chunk, return_exceptions))
+    else:
+        completed = _run_pool(chunks, workers, return_exceptions)
 
-    return results
+    if ordered:
+        completed = _in_order(completed)
+    yield from completed
 
 def debug_inputs_ground_grid(filepath, lines_list_raw, rods_list_raw, lines_list, rods_list, Geo_Grid, cable_area, selected_cable, cable_diameter, rod_length, effective_short_circuit):
     """
@@ -235,92 +440,90 @@ if __name__ == '__main__':
     results = ground_grid(filepath, fileunits, conductor_type, short_circuit_conductor,short_circuit, fault_duration, person_weight, cable_depth,
                           depth_crushed_rock, ro, ros, ambient_temperature, split_factor, rod_length, rod_diameter, case, override_mesh, parallel_separ)
 
-    print("Results:", results)
+    print("Results:", format_results(results))
 
 
-# Example IEEE B2
-
-# inputs
-filepath = "Fig_B2__mm.dxf"
-fileunits="mm"
-conductor_type = "Copper, anealed soft-drawn"
-short_circuit_conductor = 6.814 # kA
-short_circuit = 3.18  # kA
-fault_duration = 0.5  # seconds
-person_weight = 70  # kg
-cable_depth = 0.5  # meters
-depth_crushed_rock = 0.102  # meters
-ro = 400  # Ohm-m
-ros = 2500  # Ohm-m
-ambient_temperature = 40  # Celsius
-split_factor = 0.6  # Unitless
-rod_length = 7.5 # meters
-rod_diameter = 0.02  # meters
-override_mesh=False
-parallel_separ=8
-case="Sverak"
-
+    # Example IEEE B2
 
+    # inputs
+    filepath = "Fig_B2__mm.dxf"
+    fileunits="mm"
+    conductor_type = "Copper, anealed soft-drawn"
+    short_circuit_conductor = 6.814 # kA
+    short_circuit = 3.18  # kA
+    fault_duration = 0.5  # seconds
+    person_weight = 70  # kg
+    cable_depth = 0.5  # meters
+    depth_crushed_rock = 0.102  # meters
+    ro = 400  # Ohm-m
+    ros = 2500  # Ohm-m
+    ambient_temperature = 40  # Celsius
+    split_factor = 0.6  # Unitless
+    rod_length = 7.5 # meters
+    rod_diameter = 0.02  # meters
+    override_mesh=False
+    parallel_separ=8
+    case="Sverak"
 
-results = ground_grid(filepath, fileunits, conductor_type, short_circuit_conductor,short_circuit, fault_duration, person_weight, cable_depth,
-                        depth_crushed_rock, ro, ros, ambient_temperature, split_factor, rod_length, rod_diameter, case, override_mesh, parallel_separ)
 
-print("Results:", results)
 
+    results = ground_grid(filepath, fileunits, conductor_type, short_circuit_conductor,short_circuit, fault_duration, person_weight, cable_depth,
+                            depth_crushed_rock, ro, ros, ambient_temperature, split_factor, rod_length, rod_diameter, case, override_mesh, parallel_separ)
 
-# Example IEEE B3
+    print("Results:", format_results(results))
 
-# inputs
-filepath = "Fig_B3__m.dxf"
-fileunits="m"
-conductor_type = "Copper, anealed soft-drawn"
-short_circuit_conductor = 6.814 # kA
-short_circuit = 3.18  # kA
-fault_duration = 0.5  # seconds
-person_weight = 70  # kg
-cable_depth = 0.5  # meters
-depth_crushed_rock = 0.102  # meters
-ro = 400  # Ohm-m
-ros = 2500  # Ohm-m
-ambient_temperature = 40  # Celsius
-split_factor = 0.6  # Unitless
-rod_length = 10 # meters
-rod_diameter = 0.02  # meters
-case="Sverak"
 
+    # Example IEEE B3
 
+    # inputs
+    filepath = "Fig_B3__m.dxf"
+    fileunits="m"
+    conductor_type = "Copper, anealed soft-drawn"
+    short_circuit_conductor = 6.814 # kA
+    short_circuit = 3.18  # kA
+    fault_duration = 0.5  # seconds
+    person_weight = 70  # kg
+    cable_depth = 0.5  # meters
+    depth_crushed_rock = 0.102  # meters
+    ro = 400  # Ohm-m
+    ros = 2500  # Ohm-m
+    ambient_temperature = 40  # Celsius
+    split_factor = 0.6  # Unitless
+    rod_length = 10 # meters
+    rod_diameter = 0.02  # meters
+    case="Sverak"
 
-results = ground_grid(filepath, fileunits, conductor_type, short_circuit_conductor,short_circuit, fault_duration, person_weight, cable_depth,
-                        depth_crushed_rock, ro, ros, ambient_temperature, split_factor, rod_length, rod_diameter, case, override_mesh, parallel_separ)
 
-print("Results:", results)
 
+    results = ground_grid(filepath, fileunits, conductor_type, short_circuit_conductor,short_circuit, fault_duration, person_weight, cable_depth,
+                            depth_crushed_rock, ro, ros, ambient_temperature, split_factor, rod_length, rod_diameter, case, override_mesh, parallel_separ)
 
-# Example IEEE B4
+    print("Results:", format_results(results))
 
-# inputs
-filepath = "Fig_B4__mm.dxf"
-fileunits="mm"
-conductor_type = "Copper, anealed soft-drawn"
-short_circuit_conductor = 6.814 # kA
-short_circuit = 3.18  # kA
-fault_duration = 0.5  # seconds
-person_weight = 70  # kg
-cable_depth = 0.5  # meters
-depth_crushed_rock = 0.102  # meters
-ro = 400  # Ohm-m
-ros = 2500  # Ohm-m
-ambient_temperature = 40  # Celsius
-split_factor = 0.6  # Unitless
-rod_length = 7.5 # meters
-rod_diameter = 0.02  # meters
-case="Sverak"
 
+    # Example IEEE B4
 
+    # inputs
+    filepath = "Fig_B4__mm.dxf"
+    fileunits="mm"
+    conductor_type = "Copper, anealed soft-drawn"
+    short_circuit_conductor = 6.814 # kA
+    short_circuit = 3.18  # kA
+    fault_duration = 0.5  # seconds
+    person_weight = 70  # kg
+    cable_depth = 0.5  # meters
+    depth_crushed_rock = 0.102  # meters
+    ro = 400  # Ohm-m
+    ros = 2500  # Ohm-m
+    ambient_temperature = 40  # Celsius
+    split_factor = 0.6  # Unitless
+    rod_length = 7.5 # meters
+    rod_diameter = 0.02  # meters
+    case="Sverak"
 
-results = ground_grid(filepath, fileunits, conductor_type, short_circuit_conductor,short_circuit, fault_duration, person_weight, cable_depth,
-                        depth_crushed_rock, ro, ros, ambient_temperature, split_factor, rod_length, rod_diameter, case, override_mesh, parallel_separ)
 
-print("Results:", results)
 
+    results = ground_grid(filepath, fileunits, conductor_type, short_circuit_conductor,short_circuit, fault_duration, person_weight, cable_depth,
+                            depth_crushed_rock, ro, ros, ambient_temperature, split_factor, rod_length, rod_diameter, case, override_mesh, parallel_separ)
 
+    print("Results:", format_results(results))
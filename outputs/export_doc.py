@@ -8,6 +8,8 @@ from docx.oxml.ns import qn
 import pandas as pd
 import os
 
+from instrumentation import timed
+
 
 def customize_heading(doc, text, level, styles):
     """
@@ -52,6 +54,7 @@ def set_table_borders(table):
                 tcBorders.append(border)
             tcPr.append(tcBorders)
 
+@timed(category="export")
 def generate_docx(table_part1, table_part2,c, filename):
     doc = Document()
 
@@ -81,14 +84,16 @@ def generate_docx(table_part1, table_part2,c, filename):
         3: {"font_size": 12, "bold": False, "font_name": "Arial", "color": (0, 0, 0)}, 
     }
 
-    # Check compliance from the last position of table_part2
-    compliance = table_part2.iloc[-1, 1]  # Assuming compliance is in the first column of the last row
+    # Look up the results by parameter name
+    results_table = pd.concat([table_part1, table_part2])
+    values = dict(zip(results_table["Parameter"], results_table["Value"]))
+    compliance = values.get("Compliance")
     if compliance is False or str(compliance).lower() == "false":
         # Extract relevant values for the failure message
-        touch_voltage = table_part2.iloc[-3, 1]  # Assuming touch voltage is in the second column
-        touch_voltage_limit = table_part2.iloc[-4, 1]  # Assuming touch voltage limit is in the third column
-        step_voltage = table_part2.iloc[-2, 1]  # Assuming step voltage is in the fourth column
-        step_voltage_limit = table_part2.iloc[-5, 1]  # Assuming step voltage limit is in the fifth column
+        touch_voltage = values["Touch Voltage"]
+        touch_voltage_limit = values["Tolerable Touch Voltage"]
+        step_voltage = values["Step Potential"]
+        step_voltage_limit = values["Tolerable Step Voltage"]
 
         # Write the failure message (Part 1)
         failure_text_part1 = (
@@ -215,8 +220,8 @@ def generate_docx(table_part1, table_part2,c, filename):
         # Add and customize a subheading (Level 2)
         customize_heading(doc, title, level=2, styles=heading_styles)
 
-        # Exclude the last row from the DataFrame
-        df = df.iloc[:-1]
+        # Exclude the compliance flag from the DataFrame
+        df = df[df["Parameter"] != "Compliance"]
 
         # Add a table from the DataFrame
         table = doc.add_table(rows=1, cols=len(df.columns))
@@ -0,0 +1,45 @@
+# Presentation of the GroundGridResult for the GUI and the reports
+
+# Rows of the first results table (cable sizing and currents), the rest go to the second one
+SUMMARY_KEYS = ("Selected Cable", "Cable Diameter", "Conductor Short Circuit", "Short Circuit Current",
+                "Current through the grid", "Grounding Resistance")
+STATUS_KEYS = ("Step Status", "Touch Status")
+
+
+def touch_status(result):
+    if result.gpr_below_tolerables:
+        return "GPR is below the touch and step tolerable limits."
+    if result.touch_compliant:
+        return "Touch potential is within tolerable limits."
+    return "Warning: Touch potential exceeds tolerable limits!"
+
+def step_status(result):
+    if result.gpr_below_tolerables:
+        return "GPR is below the touch and step tolerable limits."
+    if result.step_compliant:
+        return "Step potential is within tolerable limits."
+    return "Warning: Step potential exceeds tolerable limits!"
+
+def format_results(result):
+    """
+    Format a GroundGridResult as the {parameter: text} dictionary shown to the user.
+    The touch and step voltages are left out when the GPR is below the tolerable values.
+    """
+    formatted = {
+        "Selected Cable": f"{result.selected_cable}",
+        "Cable Diameter": f"{round(result.cable_diameter, 2)} mm",
+        "Conductor Short Circuit": f"{round(result.short_circuit_conductor, 2)} kA",
+        "Short Circuit Current": f"{round(result.short_circuit, 2)} kA",
+        "Current through the grid": f"{round(result.grid_current, 2)} A",
+        "Grounding Resistance": f"{round(result.resistance, 2)} Ohms",
+        "GPR": f"{round(result.gpr, 2)} V",
+        "Tolerable Touch Voltage": f"{round(result.tolerable_touch, 2)} V",
+        "Tolerable Step Voltage": f"{round(result.tolerable_step, 2)} V",
+    }
+    if not result.gpr_below_tolerables:
+        formatted["Touch Voltage"] = f"{round(result.touch_voltage, 2)} V"
+        formatted["Step Potential"] = f"{round(result.step_voltage, 2)} V"
+    formatted["Compliance"] = result.compliant
+    formatted["Step Status"] = step_status(result)
+    formatted["Touch Status"] = touch_status(result)
+    return formatted
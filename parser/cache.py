@@ -0,0 +1,196 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from parser.parser import process_dxf, convert_units, as_lines_array, as_rods_array, GROUNDING_LAYER
+
+
+# Default location and size of the geometry cache
+DEFAULT_CACHE_DIR = os.environ.get(
+    "GROUNDING_CACHE_DIR", os.path.join(tempfile.gettempdir(), "grounding_geometry_cache"))
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Version of the cached arrays, part of every key. Bump it when the output of
+# process_dxf, remove_overlapping_lines or convert_units changes, so that the entries
+# written by earlier versions are no longer used.
+PARSER_VERSION = 1
+
+# Read the DXF files entity by entity (bounded memory on large drawings) unless a
+# caller chooses otherwise. Set GROUNDING_STREAMING_DXF=1 to enable it.
+STREAMING = os.environ.get("GROUNDING_STREAMING_DXF", "") not in ("", "0")
+
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """
+    Calculate the SHA-256 of a file, reading it in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class GeometryCache:
+    """
+    On-disk cache of the parsed and unit-converted geometry of DXF files.
+
+    Entries are keyed by the content of the file (SHA-256), the drawing units, the
+    grounding layer and PARSER_VERSION, and stored as compressed NumPy arrays (.npz). When the total size
+    goes over max_bytes the least recently used entries are removed.
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def key(self, file_path, units, layer=GROUNDING_LAYER):
+        """
+        Build the cache key of a DXF file for the given units and layer.
+        """
+        return hashlib.sha256(
+            f"{file_sha256(file_path)}|{units}|{layer.lower()}|v{PARSER_VERSION}".encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        """
+        Return the (lines, rods) arrays stored for a key, or None if not cached.
+        """
+        path = self._entry_path(key)
+        try:
+            with np.load(path) as data:
+                lines, rods = data["lines"], data["rods"]
+            # Touch the entry so it becomes the most recently used
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return lines, rods
+
+    def put(self, key, lines, rods):
+        """
+        Store the (lines, rods) arrays of a key and evict old entries if needed.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        lines = as_lines_array(lines)
+        rods = as_rods_array(rods)
+
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, lines=lines, rods=rods)
+            os.replace(tmp_path, self._entry_path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def entries(self):
+        """
+        List the cached entries as (path, size, last access) tuples.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                found.append((entry.path, stat.st_size, stat.st_mtime))
+        return found
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove every cached entry.
+        """
+        for path, _, _ in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        """
+        Return the hit/miss counters and the current size of the cache.
+        """
+        entries = self.entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+
+# Shared cache used by the kernel, the plots and the app
+geometry_cache = GeometryCache()
+
+
+def load_geometry(file_path, units, layer=GROUNDING_LAYER, streaming=None, cache=geometry_cache):
+    """
+    Get the lines and rods of a DXF file, converted to meters.
+
+    The result is read from the geometry cache when the same file was already parsed
+    with the same units and layer, skipping ezdxf entirely. Use cache=None to always
+    parse the file. streaming=None uses the STREAMING default.
+
+    Returns:
+        lines: (N, 2, 2) array of line segments in meters.
+        rods: (M, 2) array of rod positions in meters.
+    """
+    if streaming is None:
+        streaming = STREAMING
+    if cache is None:
+        return convert_units(*process_dxf(file_path, streaming=streaming, layer=layer), units, copy=False)
+
+    key = cache.key(file_path, units, layer)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    # The arrays of process_dxf are new, they are scaled in place
+    lines, rods = convert_units(*process_dxf(file_path, streaming=streaming, layer=layer), units, copy=False)
+
+    # A read-only or full disk must not break the calculation
+    try:
+        cache.put(key, lines, rods)
+    except OSError:
+        pass
+
+    return lines, rods
@@ -1,6 +1,9 @@
-import ezdxf
 import numpy as np
 
+from instrumentation import stage
+
+# ezdxf is imported when a file is actually read, the geometry cache avoids it
+
 
 def line_length(line):
     (x1,y1), (x2,y2) = line
@@ -32,55 +35,271 @@ def is_overlapping(line1, line2, tolerance=1e-6):
     
     return False
 
-# Function to process the dxf file
-def  process_dxf(file_path):
+# Layer and entity types holding the grounding cables and rods
+GROUNDING_LAYER = 'grounding'
+GROUNDING_TYPES = ('LINE', 'CIRCLE', 'LWPOLYLINE', 'POLYLINE')
+
+def iter_grounding_entities(file_path, layer=GROUNDING_LAYER):
+    """
+    Stream the grounding entities of a DXF file without loading the whole document.
+
+    Only the modelspace entities of the grounding types are built, one at a time,
+    and the ones outside the layer are dropped right away, so the peak memory does
+    not depend on the size of the rest of the drawing.
+    """
+    from ezdxf.addons import iterdxf
+
+    doc = iterdxf.opendxf(file_path)
+    try:
+        for entity in doc.modelspace(types=GROUNDING_TYPES):
+            if entity.dxf.layer.lower() == layer.lower():
+                yield entity
+    finally:
+        doc.close()
+
+def _read_grounding_entities(file_path, layer=GROUNDING_LAYER):
+    import ezdxf
+
     doc = ezdxf.readfile(file_path)
     msp = doc.modelspace()
+    for entity in msp.query(' '.join(GROUNDING_TYPES)):
+        if entity.dxf.layer.lower() == layer.lower():
+            yield entity
+
+# Function to process the dxf file
+def  process_dxf(file_path, streaming=False, layer=GROUNDING_LAYER):
+    """
+    Get the cables and rods of the grounding layer of a DXF file.
+
+    Args:
+        file_path: Path to the DXF file.
+        streaming: Read the file entity by entity instead of loading the whole
+                   document. Recommended for large drawings.
+        layer: Name of the layer holding the grounding grid (case insensitive).
+
+    Returns:
+        lines: (N, 2, 2) array of line segments, [start, end] x [x, y].
+        rods: (M, 2) array of rod positions.
+    """
+    if streaming:
+        entities = iter_grounding_entities(file_path, layer)
+    else:
+        entities = _read_grounding_entities(file_path, layer)
 
-    lines_list = [] #Stores cables coordinates
-    rods_list = []  #stores rods
+    line_coords = [] #Stores cables coordinates, 4 values per line
+    rod_coords = []  #stores rods, 2 values per rod
 
     # Get cables and rods
-    for entity in msp.query('LINE CIRCLE LWPOLYLINE POLYLINE'):
-        if entity.dxf.layer.lower()== 'grounding' or entity.dxf.layer.lower() == 'Grounding' or entity.dxf.layer.lower() == 'Grounding':
+    with stage("read_entities", "parser"):
+        for entity in entities:
             # get cables saveds as lines
             if entity.dxftype() == 'LINE':
-                lines_list.append([(entity.dxf.start.x,entity.dxf.start.y),(entity.dxf.end.x,entity.dxf.end.y)])
+                start, end = entity.dxf.start, entity.dxf.end
+                line_coords.extend((start.x, start.y, end.x, end.y))
 
             # get cables saved as polylines
             elif entity.dxftype() in ('LWPOLYLINE', 'POLYLINE'):
-                points = list(entity.get_points())
+                if entity.dxftype() == 'LWPOLYLINE':
+                    points = [(float(p[0]), float(p[1])) for p in entity.get_points()]
+                else:
+                    points = [(float(p[0]), float(p[1])) for p in entity.points()]
 
-                # print("points", points)
-                # print("len(points)", len(points))
+                # If the polyline is closed, add an additional line
+                if entity.is_closed and points:
+                    points.append(points[0])
 
-                for i in range(len(points) - 1):
-                    lines_list.append([(float(points[i][0]), float(points[i][1])),
-                                       (float(points[i + 1][0]), float(points[i + 1][1]))])
+                for (x1, y1), (x2, y2) in zip(points[:-1], points[1:]):
+                    line_coords.extend((x1, y1, x2, y2))
 
-                # If the polyline is closed, add an additional line
-                if entity.is_closed:
-                    lines_list.append([(float(points[-1][0]), float(points[-1][1])),
-                                       (float(points[0][0]), float(points[0][1]))])
-            
             elif entity.dxftype() == 'CIRCLE':
-                rods_list.append((float(entity.dxf.center.x),float(entity.dxf.center.y)))
+                rod_coords.extend((float(entity.dxf.center.x), float(entity.dxf.center.y)))
 
-    filtered_lines=lines_list.copy()
+        lines = np.array(line_coords, dtype=np.float64).reshape(-1, 2, 2)
+        rods = np.array(rod_coords, dtype=np.float64).reshape(-1, 2)
 
     # Remove overlapping lines
-    for line in lines_list:
-        for line2 in lines_list:
-            if line != line2 and is_overlapping(line, line2):
-                if line_length(line) < line_length(line2):
-                    if line in filtered_lines:
-                        filtered_lines.remove(line)
-                        break
-                              
-    return lines_list, rods_list
-
-def convert_units(lines_list, rods_list, unit):
-    
+    with stage("remove_overlaps", "parser"):
+        lines = remove_overlapping_lines(lines)
+
+    return lines, rods
+
+def as_lines_array(lines_list):
+    """
+    Convert a list of lines (each line is a list of two points) to an (N, 2, 2) array.
+    Arrays with the right layout are returned as they are.
+    """
+    return np.asarray(lines_list, dtype=np.float64).reshape(-1, 2, 2)
+
+def as_rods_array(rods_list):
+    """
+    Convert a list of rod positions to an (M, 2) array.
+    Arrays with the right layout are returned as they are.
+    """
+    return np.asarray(rods_list, dtype=np.float64).reshape(-1, 2)
+
+def lines_to_list(lines):
+    """
+    Convert an (N, 2, 2) array of lines to the list of lists of (x, y) tuples
+    used before the array representation.
+    """
+    return [[tuple(point) for point in line] for line in np.asarray(lines).tolist()]
+
+def rods_to_list(rods):
+    """
+    Convert an (M, 2) array of rods to a list of (x, y) tuples.
+    """
+    return [tuple(rod) for rod in np.asarray(rods).tolist()]
+
+def _line_parameters(segments):
+    """
+    Describe each segment by its supporting line.
+
+    Returns the direction angle (in (-pi/2, pi/2]), the signed offset of the line
+    from the origin, the unit direction and the length of every segment.
+    """
+    d = segments[:, 1, :] - segments[:, 0, :]
+    lengths = np.hypot(d[:, 0], d[:, 1])
+
+    # Orient every segment the same way so that a line and its reverse match
+    flip = (d[:, 0] < 0) | ((d[:, 0] == 0) & (d[:, 1] < 0))
+    d[flip] *= -1
+    ux = d[:, 0] / np.where(lengths > 0, lengths, 1)
+    uy = d[:, 1] / np.where(lengths > 0, lengths, 1)
+
+    theta = np.arctan2(uy, ux)
+    rho = segments[:, 0, 0] * (-uy) + segments[:, 0, 1] * ux
+
+    return theta, rho, ux, uy, lengths
+
+def _bucket_groups(theta, rho, angle_tolerance, tolerance):
+    """
+    Hash the (angle, offset) pairs into tolerance sized buckets and merge
+    neighbouring buckets, so that collinear segments share a group id.
+    """
+    n_angle = max(int(np.ceil(np.pi / angle_tolerance)), 1)
+    a_keys = np.minimum(np.floor((theta + np.pi / 2) / angle_tolerance), n_angle - 1).astype(np.int64)
+    r_keys = np.floor(rho / tolerance).astype(np.int64)
+
+    buckets = {}
+    for i, key in enumerate(zip(a_keys.tolist(), r_keys.tolist())):
+        buckets.setdefault(key, []).append(i)
+
+    # Union-find over the occupied buckets
+    parent = {key: key for key in buckets}
+
+    def find(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    for a, r in buckets:
+        for da in (-1, 0, 1):
+            a2 = a + da
+            # Crossing the angle seam reverses the line direction, and the offset sign
+            if 0 <= a2 < n_angle:
+                neighbours = [(a2, r + dr) for dr in (-1, 0, 1)]
+            else:
+                neighbours = [(a2 % n_angle, -r - 1 + dr) for dr in (-1, 0, 1)]
+            for key in neighbours:
+                if key in parent:
+                    root1, root2 = find((a, r)), find(key)
+                    if root1 != root2:
+                        parent[root2] = root1
+
+    groups = np.empty(len(theta), dtype=np.int64)
+    roots = {}
+    for key, members in buckets.items():
+        groups[members] = roots.setdefault(find(key), len(roots))
+
+    return groups
+
+def collinear_groups(segments, tolerance=1e-6, angle_tolerance=None):
+    """
+    Group the segments lying on the same line, within the distance tolerance and the
+    angle tolerance (radians).
+
+    By default the angle tolerance keeps the longest segment within the distance
+    tolerance. Segments shorter than the tolerance are marked as not valid.
+
+    Returns:
+        groups: Group id of every segment.
+        t_start, t_end: Extent of every segment along the direction of its group.
+        ux, uy, rho: Direction and offset of the line of the group of every segment.
+        valid: Segments longer than the tolerance.
+    """
+    theta, rho, ux, uy, lengths = _line_parameters(segments)
+    valid = lengths > tolerance
+
+    if angle_tolerance is None:
+        angle_tolerance = max(tolerance / max(float(lengths.max()), tolerance), 1e-15)
+    groups = _bucket_groups(theta, rho, angle_tolerance, tolerance)
+
+    # Project the segments of a group on the line of its first member
+    _, first = np.unique(groups, return_index=True)
+    ref_x = ux[first][groups]
+    ref_y = uy[first][groups]
+    t1 = segments[:, 0, 0] * ref_x + segments[:, 0, 1] * ref_y
+    t2 = segments[:, 1, 0] * ref_x + segments[:, 1, 1] * ref_y
+
+    return groups, np.minimum(t1, t2), np.maximum(t1, t2), ref_x, ref_y, rho[first][groups], valid
+
+# Function to remove the lines that are already covered by a longer collinear line
+def remove_overlapping_lines(lines_list, tolerance=1e-6):
+    """
+    Remove duplicated and overlapped cables from a list of lines.
+
+    A line is dropped when it is collinear with another line (within the tolerance)
+    and fully covered by it. Partially overlapping lines are kept. Lines are bucketed
+    by their supporting line, so the cost is O(n log n) instead of comparing every pair.
+
+    Args:
+        lines_list: A list of line segments (each line is a list of two points).
+        tolerance: Distance tolerance in drawing units.
+
+    Returns:
+        The lines without the overlapped ones, in the original order. Arrays give an
+        array back and lists give a list.
+    """
+    segments = as_lines_array(lines_list)
+    if len(segments) == 0:
+        return segments if isinstance(lines_list, np.ndarray) else []
+
+    # Zero-length lines do not add any conductor
+    groups, t_start, t_end, _, _, _, valid = collinear_groups(segments, tolerance)
+
+    # Sort by group, then by start of the line and longest first
+    order = np.lexsort((-t_end, t_start, groups))
+    keep = valid.copy()
+    valid_l, groups_l, t_end_l = valid.tolist(), groups.tolist(), t_end.tolist()
+    current_group = None
+    max_end = -np.inf
+    for i in order.tolist():
+        if not valid_l[i]:
+            continue
+        if groups_l[i] != current_group:
+            current_group = groups_l[i]
+            max_end = t_end_l[i]
+            continue
+        # Any earlier line in the group starts before this one, so it covers it
+        # as long as it also reaches its end
+        if t_end_l[i] <= max_end + tolerance:
+            keep[i] = False
+        else:
+            max_end = t_end_l[i]
+
+    if isinstance(lines_list, np.ndarray):
+        return segments[keep]
+    return [line for line, kept in zip(lines_list, keep.tolist()) if kept]
+
+def convert_units(lines_list, rods_list, unit, copy=True):
+    """
+    Scale the lines and rods from the drawing units to meters.
+
+    New arrays are returned, the ones given are left unchanged. With copy=False,
+    float64 arrays are scaled in place and returned, so only use it on arrays nobody
+    else holds (as the fresh ones of process_dxf); for 'm' they are returned as is.
+    """
     # Define scale factors for each unit
     scale_factors = {
         'mm': 1 / 1000,  # Convert millimeters to meters
@@ -96,18 +315,16 @@ def convert_units(lines_list, rods_list, unit):
     # Get the scale factor for the given unit
     scale_factor = scale_factors[unit]
 
-    # Convert lines_list to meters
-    converted_lines_list = [
-        [(x1 * scale_factor, y1 * scale_factor), (x2 * scale_factor, y2 * scale_factor)]
-        for (x1, y1), (x2, y2) in lines_list
-    ]
-
-    # Convert rods_list to meters
-    converted_rods_list = [
-        (x * scale_factor, y * scale_factor) for (x, y) in rods_list
-    ]
+    # Convert to meters
+    lines = as_lines_array(lines_list)
+    rods = as_rods_array(rods_list)
+    if copy:
+        return lines * scale_factor, rods * scale_factor
+    if scale_factor != 1:
+        lines *= scale_factor
+        rods *= scale_factor
 
-    return converted_lines_list, converted_rods_list
+    return lines, rods
 
 
 
@@ -125,8 +342,7 @@ if __name__ == "__main__":
     print("Lines:", lines_list_mm)
     print("Rods:", rods_list_mm)
 
-    lines_list_m = [[(x1 / 1000, y1 / 1000), (x2 / 1000, y2 / 1000)] for (x1, y1), (x2, y2) in lines_list_mm]
-    rods_list_m = [(x / 1000, y / 1000) for (x, y) in rods_list_mm]
+    lines_list_m, rods_list_m = convert_units(lines_list_mm, rods_list_mm, 'mm')
     print("Lines:", lines_list_m)
     print("Rods:", rods_list_m)
 
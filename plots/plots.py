@@ -1,23 +1,141 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
 import matplotlib.pyplot as plt
-from parser.parser import process_dxf, convert_units
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgb
+from parser.cache import load_geometry
+from parser.parser import collinear_groups
+from instrumentation import timed
+
+
+# Above this number of segments the collinear runs are merged, and if there are still
+# too many segments they are drawn as an image (level of detail)
+LOD_SEGMENTS = 10_000
+
+# Rendered PNG images by geometry hash and size, shared by every caller of grid_png.
+# Set GROUNDING_PREVIEW_CACHE_MB to change their memory cap.
+PNG_CACHE_BYTES = int(os.environ.get("GROUNDING_PREVIEW_CACHE_MB", 64)) * 2**20
+_png_cache = OrderedDict()
+_png_lock = threading.Lock()
+png_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def merge_collinear(lines, tolerance=1e-6, angle_tolerance=None):
+    """
+    Merge the collinear segments that touch or overlap, e.g. a grid conductor drawn
+    as one segment between every crossing becomes a single segment. The segments on
+    the same line are found as in remove_overlapping_lines.
+
+    Args:
+        lines: (N, 2, 2) array of segments.
+        tolerance: Distance (drawing units) under which points are the same.
+        angle_tolerance: Angle (radians) under which directions are the same, by
+                         default the one keeping the longest segment within tolerance.
+
+    Returns:
+        (K, 2, 2) array of segments, K <= N. Zero length segments are dropped.
+    """
+    lines = np.asarray(lines, dtype=np.float64).reshape(-1, 2, 2)
+    if len(lines) == 0:
+        return lines
+    groups, lo, hi, ux, uy, rho, valid = collinear_groups(lines, tolerance, angle_tolerance)
+    if valid.sum() < 2:
+        return lines[valid]
+
+    # Segments on the same line, in order along it
+    order = np.flatnonzero(valid)
+    order = order[np.lexsort((lo[order], groups[order]))]
+    groups, lo, hi, ux, uy, rho = groups[order], lo[order], hi[order], ux[order], uy[order], rho[order]
+    new_line = np.ones(len(lo), dtype=bool)
+    new_line[1:] = groups[1:] != groups[:-1]
+
+    # A run starts on a new line or after a gap. Every line is moved past the previous
+    # one so that the running maximum does not carry over from one line to the next.
+    span = hi.max() - lo.min() + 1.0
+    shift = (np.cumsum(new_line) - 1) * span - lo.min()
+    reach = np.maximum.accumulate(hi + shift)
+    starts = new_line.copy()
+    starts[1:] |= lo[1:] + shift[1:] > reach[:-1] + tolerance
+    first = np.flatnonzero(starts)
+
+    # Ends of the runs on the line of their group
+    run_lo = lo[first]
+    run_hi = np.maximum.reduceat(hi, first)
+    u = np.column_stack([ux[first], uy[first]])
+    normal = np.column_stack([-uy[first], ux[first]])
+    start = run_lo[:, None] * u + rho[first, None] * normal
+    end = run_hi[:, None] * u + rho[first, None] * normal
+    return np.stack([start, end], axis=1)
+
+def rasterise_lines(ax, lines, resolution=1200, width=3, color="b", max_samples=4_000_000):
+    """
+    Draw the segments as an image of resolution pixels on its longest side, with lines
+    width pixels wide, scaled down smoothly to the size of the axes. The cost depends
+    on the total length of the segments in pixels, not on their number.
+
+    Returns the image, or None (nothing drawn) when the segments are too long for it
+    to be cheaper than drawing them: over max_samples pixels in total.
+    """
+    points = lines.reshape(-1, 2)
+    x_min, y_min = points.min(axis=0)
+    x_max, y_max = points.max(axis=0)
+    pixel = max(x_max - x_min, y_max - y_min, 1e-9) / (resolution - 1)
+    nx, ny = int((x_max - x_min) / pixel) + 1, int((y_max - y_min) / pixel) + 1
 
+    # Points along every segment, one per pixel crossed
+    d = lines[:, 1] - lines[:, 0]
+    steps = np.ceil(np.hypot(d[:, 0], d[:, 1]) / pixel).astype(np.int64) + 1
+    if steps.sum() > max_samples:
+        return None
+    segment = np.repeat(np.arange(len(lines)), steps)
+    position = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+    fraction = position / np.maximum(steps - 1, 1)[segment]
+    samples = lines[segment, 0] + fraction[:, None] * d[segment]
 
-def plot_grid_with_lines_and_rods(filepath, fileunits, polygon=None, complete=True, title="Grounding Grid"):
+    # Transparent image, opaque where a segment passes
+    image = np.zeros((ny, nx, 4))
+    image[..., :3] = to_rgb(color)
+    ix = np.rint((samples[:, 0] - x_min) / pixel).astype(np.int64).clip(0, nx - 1)
+    iy = np.rint((samples[:, 1] - y_min) / pixel).astype(np.int64).clip(0, ny - 1)
+    for dx in range(-(width // 2), width - width // 2):
+        image[iy, (ix + dx).clip(0, nx - 1), 3] = 1.0
+        image[(iy + dx).clip(0, ny - 1), ix, 3] = 1.0
+
+    half = pixel / 2
+    artist = ax.imshow(image, origin="lower", interpolation="antialiased", aspect="auto",
+                       extent=(x_min - half, x_max + half, y_min - half, y_max + half))
+    # Margins around the image like around the other artists
+    artist.sticky_edges.x.clear()
+    artist.sticky_edges.y.clear()
+    return artist
+
+@timed(category="plots")
+def plot_grid_with_lines_and_rods(filepath=None, fileunits=None, polygon=None, complete=True, title="Grounding Grid",
+                                  lines=None, rods=None, lod=LOD_SEGMENTS):
     """
     Plot the grounding grid polygon along with the lines_list and rods_list.
-    
+
     Args:
+        filepath, fileunits: DXF file and drawing units, parsed when lines and rods
+                             are not given.
         polygon: The Shapely polygon object representing the grounding grid.
-        lines_list: A list of line segments (each line is a list of two points).
-        rods_list: A list of rod positions (each rod is a tuple of x, y coordinates).
+        complete: Also plot the lines and the rods.
         title: The title of the plot.
-    
+        lines: (N, 2, 2) array of the line segments, in meters.
+        rods: (M, 2) array of the rod positions, in meters.
+        lod: Number of segments above which the level of detail is reduced, None to
+             always draw every segment.
     """
-    # Parse the DXF file to get the lines and rods
-    lines_list_raw, rods_list_raw = process_dxf(filepath)
-
-    # Scale the lines and rods
-    lines_list, rods_list =convert_units(lines_list_raw, rods_list_raw, fileunits)
+    if lines is None or rods is None:
+        # Parse the DXF file to get the lines and rods scaled to meters (cached by file content)
+        lines, rods = load_geometry(filepath, fileunits)
+    lines = np.asarray(lines, dtype=np.float64).reshape(-1, 2, 2)
+    rods = np.asarray(rods, dtype=np.float64).reshape(-1, 2)
 
      # Create a figure and axes
     fig, ax = plt.subplots(figsize=(8, 8))
@@ -27,17 +145,17 @@ def plot_grid_with_lines_and_rods(filepath, fileunits, polygon=None, complete=Tr
         x, y = polygon.exterior.xy
         ax.plot(x, y, 'b-', label="Polygon Boundary")  # Polygon boundary in blue
 
-
     if complete:
-         # Plot the lines_list
-        for line in lines_list:
-            x, y = zip(*line)
-            ax.plot(x, y, 'b-', label="Lines" if 'Lines' not in ax.get_legend_handles_labels()[1] else "")  # Lines in blue
+        # Plot the lines in blue, a single artist for all of them
+        if lod is not None and len(lines) > lod:
+            lines = merge_collinear(lines)
+        if lod is not None and len(lines) > lod and rasterise_lines(ax, lines) is not None:
+            ax.plot([], [], 'b-', label="Lines")
+        else:
+            ax.add_collection(LineCollection(lines, colors="b", label="Lines"))
 
-        # Plot the rods_list
-        for rod in rods_list:
-            x, y = rod
-            ax.plot(x, y, 'ro', label="Rods" if 'Rods' not in ax.get_legend_handles_labels()[1] else "")  # Rods as red dots
+        # Plot the rods as red dots
+        ax.scatter(rods[:, 0], rods[:, 1], c="r", s=20, zorder=3, label="Rods")
 
     # Add labels and legend
     ax.set_title(title)
@@ -47,11 +165,65 @@ def plot_grid_with_lines_and_rods(filepath, fileunits, polygon=None, complete=Tr
     ax.legend()
     ax.set_aspect('equal', adjustable='datalim', anchor='C')
 
-    # Set x-axis limits based on the data
-    all_x = [point[0] for line in lines_list for point in line] + [rod[0] for rod in rods_list]
-    x_min, x_max = min(all_x), max(all_x)
-    ax.set_xlim(x_min - 10, x_max + 10)  # Add some padding to the x-axis limits
+    # Set the axes limits based on the data, with some padding on the x-axis. The limits
+    # stay automatic, fixed ones would be overridden by the equal aspect.
+    points = np.concatenate([lines.reshape(-1, 2), rods])
+    if len(points):
+        (x_min, y_min), x_max = points.min(axis=0), points[:, 0].max()
+        ax.update_datalim([(x_min - 10, y_min), (x_max + 10, y_min)])
+        ax.autoscale_view()
     plt.close(fig)
 
     # Return the figure
     return fig
+
+def figure_png(fig, width, height, dpi=96):
+    """
+    PNG bytes of a figure drawn at width x height pixels.
+    """
+    fig.set_size_inches(width / dpi, height / dpi)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi)
+    return buffer.getvalue()
+
+def geometry_hash(lines, rods):
+    """
+    SHA-256 of the lines and rods arrays.
+    """
+    digest = hashlib.sha256()
+    for array in (lines, rods):
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+def grid_png(lines, rods, width, height, dpi=96, title="Grounding Grid", lod=LOD_SEGMENTS):
+    """
+    PNG bytes of the grid plot at width x height pixels, rendered once per geometry
+    and size. The images are kept while they fit in PNG_CACHE_BYTES.
+    """
+    key = (geometry_hash(lines, rods), width, height, dpi, title, lod)
+    with _png_lock:
+        png = _png_cache.get(key)
+        if png is not None:
+            _png_cache.move_to_end(key)
+            png_cache_stats["hits"] += 1
+            return png
+        png_cache_stats["misses"] += 1
+
+    fig = plot_grid_with_lines_and_rods(lines=lines, rods=rods, title=title, lod=lod)
+    png = figure_png(fig, width, height, dpi)
+    with _png_lock:
+        _png_cache[key] = png
+        while len(_png_cache) > 1 and sum(map(len, _png_cache.values())) > PNG_CACHE_BYTES:
+            _png_cache.popitem(last=False)
+            png_cache_stats["evictions"] += 1
+    return png
+
+def png_cache_info():
+    """
+    Number of images, size and cap (bytes) and counters of the PNG cache.
+    """
+    with _png_lock:
+        return dict(png_cache_stats, images=len(_png_cache), bytes=sum(map(len, _png_cache.values())),
+                    max_bytes=PNG_CACHE_BYTES)
@@ -3,13 +3,22 @@ import os
 from pathlib import Path
 import pytest
 import numpy as np
+from scipy.spatial import ConvexHull
 
 
 # sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from ..parser.parser import process_dxf
+from ..parser.parser import process_dxf, remove_overlapping_lines, convert_units, lines_to_list, rods_to_list
+from ..parser.cache import GeometryCache, load_geometry
 from ..calcs.calc_cable_size import cable_sizing
 from ..calcs.calc_tolerables import Etouch,Estep,surface_correction
-from ..calcs.calc_rpt import Rpt
+from ..calcs.calc_rpt import Resistance as Rpt, Resistance_all, register_model, RESISTANCE_MODELS
+from ..calcs.class_grid import GroundingGrid
+from ..calcs.calc_ks import k1, k2, k1_array, k2_array
+from ..calcs.class_geom_etry import Geom_etry, convex_diameter, extract_meshes
+from ..kernel import ground_grid, ground_grid_many, GroundGridPipeline, GroundGridResult
+from ..calcs.class_result import stack_results
+from ..outputs.format_results import format_results
+from ..batch import main as batch_main
 
 
 @pytest.fixture
@@ -69,3 +78,618 @@ def test_Rpt(sample_values_rpt): # for example 4 IEEE 80 Appendix B
     rpt = Rpt(ro, A, Lt, depth, diameter_cond, nrods, rod_length, rod_diam, side1, side2, side3, side4, D, shape="L", case="Sverak")
     expected_rpt = 2.74  # Expected value from IEEE 80 Appendix B example 4
     np.testing.assert_almost_equal(rpt, expected_rpt, decimal=2)
+
+
+def test_remove_overlapping_lines():
+    lines_list = [[(0, 0), (10, 0)],
+                  [(2, 0), (5, 0)],     # covered by the first line
+                  [(10, 0), (0, 0)],    # same line drawn backwards
+                  [(0, 0), (0, 5)],
+                  [(0, 2), (0, 3)],     # covered by the vertical line
+                  [(5, 0), (12, 0)],    # partial overlap, kept
+                  [(0, 1), (1, 1)]]     # parallel, not collinear
+    filtered = remove_overlapping_lines(lines_list)
+    assert filtered == [[(0, 0), (10, 0)], [(0, 0), (0, 5)], [(5, 0), (12, 0)], [(0, 1), (1, 1)]]
+
+
+@pytest.mark.parametrize("filename", ["Fig_B2__mm.dxf", "Fig_B3__m.dxf", "Fig_B4__mm.dxf", "Grounding_Test.dxf"])
+def test_process_dxf_streaming(filename):
+    filepath = Path(__file__).parent.parent / filename
+    lines, rods = process_dxf(filepath)
+    lines_streamed, rods_streamed = process_dxf(filepath, streaming=True)
+    np.testing.assert_array_equal(lines_streamed, lines)
+    np.testing.assert_array_equal(rods_streamed, rods)
+
+
+def test_geometry_cache(tmp_path, monkeypatch):
+    from ..parser import cache as parser_cache
+    filepath = Path(__file__).parent.parent / "Fig_B2__mm.dxf"
+    cache = GeometryCache(directory=tmp_path / "cache")
+
+    expected_lines, expected_rods = convert_units(*process_dxf(filepath), "mm")
+    for _ in range(2):
+        lines, rods = load_geometry(filepath, "mm", cache=cache)
+        np.testing.assert_array_equal(lines, expected_lines)
+        np.testing.assert_array_equal(rods, expected_rods)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Other units are a different entry, and the cap keeps only the newest one
+    cache.max_bytes = 1.5 * cache.stats()["bytes"]
+    load_geometry(filepath, "m", cache=cache)
+    assert cache.stats()["entries"] == 1
+    assert cache.evictions == 1
+
+    # Entries written by another version of the parser are not used
+    key = cache.key(filepath, "m")
+    monkeypatch.setattr(parser_cache, "PARSER_VERSION", parser_cache.PARSER_VERSION + 1)
+    assert cache.key(filepath, "m") != key and cache.get(cache.key(filepath, "m")) is None
+
+    # Unless the caller chooses, the STREAMING default picks the reader
+    readers = []
+    def spy(file_path, streaming=False, layer=None):
+        readers.append(streaming)
+        return process_dxf(file_path, streaming=streaming, layer=layer)
+    monkeypatch.setattr(parser_cache, "process_dxf", spy)
+    monkeypatch.setattr(parser_cache, "STREAMING", True)
+    lines, rods = load_geometry(filepath, "mm", cache=None)
+    load_geometry(filepath, "mm", streaming=False, cache=None)
+    assert readers == [True, False]
+    np.testing.assert_array_equal(lines, expected_lines)
+
+
+def test_array_geometry():
+    filepath = Path(__file__).parent.parent / "Fig_B2__mm.dxf"
+    lines, rods = process_dxf(filepath)
+    assert lines.shape == (22, 2, 2) and rods.shape == (20, 2)
+    assert lines.dtype == np.float64 and rods.dtype == np.float64
+
+    # The list adapters give the same geometry back as lists of tuples
+    lines_list, rods_list = lines_to_list(lines), rods_to_list(rods)
+    assert isinstance(lines_list[0][0], tuple) and isinstance(rods_list[0], tuple)
+    lines_m, rods_m = convert_units(lines_list, rods_list, "mm")
+    np.testing.assert_allclose(lines_m, lines / 1000)
+    np.testing.assert_allclose(rods_m, rods / 1000)
+
+    # The arrays given are left unchanged, even read-only ones
+    original = lines.copy()
+    lines.setflags(write=False)
+    for unit in ("mm", "mm", "m"):
+        lines_m, _ = convert_units(lines, rods, unit)
+        assert lines_m is not lines
+    np.testing.assert_array_equal(lines, original)
+
+
+def test_convex_diameter_random_polygons():
+    rng = np.random.default_rng(80)
+    for n_points in (3, 10, 100, 1000):
+        for _ in range(5):
+            # Random star-shaped polygon around the origin
+            angles = np.sort(rng.uniform(0, 2 * np.pi, n_points))
+            radius = rng.uniform(10, 100, n_points)
+            points = np.column_stack((radius * np.cos(angles), radius * np.sin(angles)))
+
+            hull = ConvexHull(points)
+            diff = points[:, None, :] - points[None, :, :]
+            brute_force = np.hypot(diff[..., 0], diff[..., 1]).max()
+            np.testing.assert_allclose(convex_diameter(points[hull.vertices]), brute_force)
+
+def test_geom_etry_max_distance():
+    lines_list = [[(0, 0), (70, 0)], [(70, 0), (70, 35)], [(70, 35), (0, 35)], [(0, 35), (0, 0)],
+                  [(35, 0), (35, 35)], [(0, 17.5), (70, 17.5)]]
+    geometry = Geom_etry(lines_list, [(0, 0), (70, 35)])
+    np.testing.assert_allclose(geometry.max_dist, np.hypot(70, 35))
+
+
+def test_check_rods_location():
+    lines_list = [[(0, 0), (70, 0)], [(70, 0), (70, 35)], [(70, 35), (0, 35)], [(0, 35), (0, 0)]]
+    rods_list = [(0, 0), (35, 1), (35, 17.5), (100, 100)]
+    geometry = Geom_etry(lines_list, rods_list)
+    assert geometry.rods_classification.tolist() == ["perimeter", "perimeter", "interior", "outside"]
+    assert geometry.location_rods == "perimeter"
+
+    # Rods only in the middle of the grid are not perimeter rods
+    geometry = Geom_etry(lines_list, [(35, 17.5)])
+    assert geometry.location_rods == "non_perimeter"
+
+
+def test_geom_etry_lazy_properties():
+    lines_list = [[(0, 0), (70, 0)], [(70, 0), (70, 35)], [(70, 35), (0, 35)], [(0, 35), (0, 0)],
+                  [(35, 0), (35, 35)], [(0, 17.5), (70, 17.5)]]
+    geometry = Geom_etry(lines_list, [(0, 0)])
+    np.testing.assert_allclose(geometry.area, 70 * 35)
+
+    # Only the area and what it depends on have been computed
+    assert {"hull", "polyg_on", "area"} <= set(vars(geometry))
+    assert not {"max_dist", "max_separation", "location_rods", "line_lengths"} & set(vars(geometry))
+
+    eager = Geom_etry(lines_list, [(0, 0)]).compute_all()
+    assert eager.shape == geometry.shape == "rectangle"
+    assert eager.max_separation == geometry.max_separation
+
+
+def test_extract_meshes():
+    # 2 x 1 grid of 7 m meshes with uneven spacing on the right, and a diagonal
+    lines_list = [[(0, 0), (17, 0)], [(0, 7), (17, 7)], [(0, 0), (0, 7)], [(7, 0), (7, 7)],
+                  [(17, 0), (17, 7)], [(0, 0), (7, 7)]]
+    meshes, areas, dimensions = extract_meshes(lines_list)
+    assert len(meshes) == 3
+    np.testing.assert_allclose(np.sort(areas), [24.5, 24.5, 70])
+    np.testing.assert_allclose(dimensions[np.argmax(areas)], [10, 7])
+
+    geometry = Geom_etry(lines_list, [])
+    assert geometry.mesh_separation == 10
+    np.testing.assert_allclose(geometry.largest_mesh.area, 70)
+
+
+@pytest.fixture
+def sample_grid():
+    # IEEE 80 Appendix B, example 2
+    side1, side2, D = 70, 70, 7
+    return dict(cable_diameter=0.01, rod_diameter=0.02, location_rods="perimeter", shape="rectangle",
+                side1=side1, side2=side2, side3=0, side4=0, A=side1 * side2,
+                Lc=(side1 / D + 1) * side2 + (side2 / D + 1) * side1, Lp=2 * (side1 + side2),
+                Dm=np.hypot(side1, side2), Lx=side1, Ly=side2)
+
+@pytest.mark.parametrize("case", ["Sverak", "Schwarz", "simplified1", "simplified2"])
+def test_grounding_grid_batch(sample_grid, case):
+    rng = np.random.default_rng(80)
+    n = 50
+    ro = rng.uniform(50, 1000, n)
+    cable_depth = rng.uniform(0.3, 1.5, n)
+    D = rng.uniform(3, 15, n)
+    num_rods = rng.integers(0, 40, n)
+    rod_length = rng.uniform(3, 10, n)
+    current = rng.uniform(500, 5000, n)
+
+    batch = GroundingGrid(ro, cable_depth, num_rods=num_rods, rod_length=rod_length, D=D, case=case, **sample_grid)
+    Rg, Em, Es = batch.evaluate(current)
+    assert Rg.shape == Em.shape == Es.shape == (n,)
+
+    for i in range(n):
+        grid = GroundingGrid(ro[i], cable_depth[i], num_rods=num_rods[i], rod_length=rod_length[i], D=D[i],
+                             case=case, **sample_grid)
+        np.testing.assert_allclose([Rg[i], Em[i], Es[i]], [grid.Rpt, grid.Em(current[i]), grid.Es(current[i])])
+
+def test_grounding_grid_broadcast(sample_grid):
+    # Soil resistivities x fault currents
+    ro = np.array([100, 400, 1000])[:, None]
+    current = np.array([1000, 1908, 3000])[None, :]
+    grid = GroundingGrid(ro, 0.5, num_rods=20, rod_length=7.5, D=7, case="Sverak", **sample_grid)
+    Rg, Em, Es = grid.evaluate(current)
+    assert Rg.shape == Em.shape == Es.shape == (3, 3)
+    np.testing.assert_allclose(Em[1, 1], GroundingGrid(400, 0.5, num_rods=20, rod_length=7.5, D=7, case="Sverak",
+                                                        **sample_grid).Em(1908))
+
+
+def test_k1_k2_array():
+    rng = np.random.default_rng(80)
+    ratio = rng.uniform(1, 8, 2000)
+    A = rng.uniform(10, 10000, 2000)
+    h = rng.uniform(-0.5, 30, 2000)
+    # Exactly on the breakpoints too
+    h[:3] = [0, 1/10*np.sqrt(A[1]), 1/6*np.sqrt(A[2])]
+
+    np.testing.assert_array_equal(k1_array(ratio, h, A), [k1(r, hi, a) for r, hi, a in zip(ratio, h, A)])
+    np.testing.assert_array_equal(k2_array(ratio, h, A), [k2(r, hi, a) for r, hi, a in zip(ratio, h, A)])
+    assert k1(1, [0.2, 0.5], 4900) == [k1(1, 0.2, 4900), k1(1, 0.5, 4900)]
+
+
+def test_resistance_all_models(sample_grid):
+    ro = np.array([100, 400, 1000])
+    grid = GroundingGrid(ro, 0.5, num_rods=20, rod_length=7.5, D=7, case="Sverak", **sample_grid)
+    models = grid.Calc_Resistance_models()
+    assert set(models) == {"simplified1", "simplified2", "Sverak", "Schwarz"}
+    np.testing.assert_allclose(models["Sverak"], grid.Rpt)
+    for case, Rg in models.items():
+        assert Rg.shape == (3,)
+        expected = [GroundingGrid(r, 0.5, num_rods=20, rod_length=7.5, D=7, case=case, **sample_grid).Rpt for r in ro]
+        np.testing.assert_allclose(Rg, expected)
+
+def test_register_resistance_model(sample_values_rpt):
+    ro, side1, side2, side3, side4, nrods, rod_length, D, A, Lt, rod_diam, depth, diameter_cond = sample_values_rpt
+
+    @register_model("Laurent")
+    def laurent(t):
+        return t["ro"]/4*np.sqrt(np.pi/t["A"])+t["ro"]/t["Lc"]
+
+    try:
+        models = Resistance_all(ro, A, Lt, depth, diameter_cond, nrods, rod_length, rod_diam, side1, side2, side3, side4,
+                                D, shape="L", cases=["Sverak", "Laurent"])
+        assert list(models) == ["Sverak", "Laurent"]
+        np.testing.assert_almost_equal(models["Sverak"], 2.74, decimal=2)
+        assert Rpt(ro, A, Lt, depth, diameter_cond, nrods, rod_length, rod_diam, side1, side2, side3, side4, D,
+                   shape="L", case="laurent") == models["Laurent"]
+    finally:
+        RESISTANCE_MODELS.pop("laurent")
+
+
+@pytest.fixture
+def ground_grid_inputs():
+    # IEEE 80 Appendix B, example 2
+    return dict(filepath=str(Path(__file__).parent.parent / "Fig_B2__mm.dxf"), fileunits="mm",
+                conductor_type="Copper, anealed soft-drawn", short_circuit_conductor=6.814, short_circuit=3.18,
+                fault_duration=0.5, person_weight=70, cable_depth=0.5, depth_crushed_rock=0.102, ro=400, ros=2500,
+                ambient_temperature=40, split_factor=0.6, rod_length=7.5, rod_diameter=0.02, case="Sverak",
+                override_mesh=False, parallel_separ=8)
+
+def test_ground_grid_pipeline(ground_grid_inputs):
+    pipeline = GroundGridPipeline()
+    first = ground_grid(**ground_grid_inputs, pipeline=pipeline)
+    assert pipeline.recomputed() == [name for name, _ in pipeline.trace]
+
+    # Same inputs, only the results are reused
+    assert ground_grid(**ground_grid_inputs, pipeline=pipeline) == first
+    assert pipeline.recomputed() == []
+
+    # The fault duration does not touch the geometry
+    edited = dict(ground_grid_inputs, fault_duration=0.8)
+    results = ground_grid(**edited, pipeline=pipeline)
+    assert pipeline.recomputed() == ["cable", "grid", "tolerable", "voltages", "results"]
+    assert results == ground_grid(**edited, pipeline=GroundGridPipeline())
+
+    edited = dict(ground_grid_inputs, person_weight=50)
+    results = ground_grid(**edited, pipeline=pipeline)
+    assert pipeline.recomputed() == ["tolerable", "results"]
+    assert results == ground_grid(**edited, pipeline=GroundGridPipeline())
+
+    # Going back to a previous input reuses everything
+    ground_grid(**ground_grid_inputs, pipeline=pipeline)
+    assert pipeline.recomputed() == []
+
+def test_ground_grid_result(ground_grid_inputs):
+    result = ground_grid(**ground_grid_inputs)
+    assert isinstance(result, GroundGridResult)
+    # IEEE 80 Appendix B, example 2
+    np.testing.assert_almost_equal(result.resistance, 2.75, decimal=2)
+    assert result.n == 11
+    np.testing.assert_almost_equal(result.Ki, 2.272)
+    assert not result.gpr_below_tolerables and result.compliant
+
+    formatted = format_results(result)
+    assert formatted["Grounding Resistance"] == "2.75 Ohms"
+    assert formatted["Compliance"] is True
+    assert formatted["Touch Status"] == "Touch potential is within tolerable limits."
+
+    # Small currents keep the GPR under the tolerable voltages
+    low = ground_grid(**dict(ground_grid_inputs, short_circuit=0.1))
+    assert low.gpr_below_tolerables
+    assert "Touch Voltage" not in format_results(low)
+
+    stacked = stack_results([result, low])
+    np.testing.assert_array_equal(stacked["grid_current"], [1908, 60])
+    assert stacked["compliant"].all()
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_ground_grid_many(ground_grid_inputs, workers):
+    b3 = str(Path(__file__).parent.parent / "Fig_B3__m.dxf")
+    scenarios = [dict(ground_grid_inputs, ro=ro) for ro in (100, 400, 1000)]
+    scenarios += [dict(ground_grid_inputs, filepath=b3, fileunits="m", rod_length=10)]
+    scenarios += [dict(ground_grid_inputs, ro=ro, fileunits="mm") for ro in (200, 300)]
+    expected = [ground_grid(**scenario) for scenario in scenarios]
+
+    results = list(ground_grid_many(iter(scenarios), workers=workers, chunksize=2))
+    assert [index for index, _ in results] == list(range(len(scenarios)))
+    assert [result for _, result in results] == expected
+
+    unordered = ground_grid_many(scenarios, workers=workers, chunksize=2, ordered=False)
+    assert sorted(unordered, key=lambda pair: pair[0]) == results
+
+    # A wrong scenario does not stop the others
+    scenarios[1] = dict(scenarios[1], fileunits="yards")
+    results = dict(ground_grid_many(scenarios, workers=workers, return_exceptions=True))
+    assert isinstance(results[1], ValueError)
+    assert results[2] == expected[2]
+
+def test_batch_runner(ground_grid_inputs, tmp_path, monkeypatch):
+    import csv
+    import json
+
+    scenarios = [dict(ground_grid_inputs, ro=ro) for ro in (100, 400, 1000)]
+    scenarios[1]["fileunits"] = "yards"
+    input_path = tmp_path / "scenarios.csv"
+    with open(input_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(ground_grid_inputs))
+        writer.writeheader()
+        writer.writerows(scenarios)
+
+    output_path = tmp_path / "results.jsonl"
+    assert batch_main([str(input_path), str(output_path), "--chunksize", "1"]) == 0
+    rows = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert [row["row"] for row in rows] == [0, 1, 2]
+    assert rows[0]["resistance"] == ground_grid(**scenarios[0]).resistance
+    assert rows[1]["error"].startswith("ValueError") and rows[1]["resistance"] is None
+
+    # An interrupted run leaves a partial row, resuming replaces it and goes on
+    output_path.write_text(output_path.read_text()[:-40])
+    assert batch_main([str(input_path), str(output_path), "--resume"]) == 0
+    assert [json.loads(line) for line in output_path.read_text().splitlines()] == rows
+
+    # The partial row is found reading back in blocks, here shorter than the rows
+    from ..batch import resume_offset
+    complete = output_path.read_bytes()
+    output_path.write_bytes(complete + b'{"row": 3, "resist')
+    assert resume_offset(str(output_path), "jsonl", block_size=8) == 3
+    assert output_path.read_bytes() == complete
+    output_path.write_bytes(b'{"row": 0, "resist')
+    assert resume_offset(str(output_path), "jsonl", block_size=8) == 0
+    assert output_path.read_bytes() == b""
+
+    # --streaming turns the streaming reader on, also for the worker processes
+    from .. import batch
+    monkeypatch.setattr(batch.parser_cache, "STREAMING", False)
+    monkeypatch.setenv("GROUNDING_STREAMING_DXF", "0")
+    streamed_path = tmp_path / "streamed.jsonl"
+    assert batch_main([str(input_path), str(streamed_path), "--streaming"]) == 0
+    assert batch.parser_cache.STREAMING and os.environ["GROUNDING_STREAMING_DXF"] == "1"
+    assert [json.loads(line) for line in streamed_path.read_text().splitlines()] == rows
+
+# Import budget of the calculation path, and packages it must not import
+KERNEL_IMPORT_BUDGET_US = 500_000
+HEAVY_PACKAGES = {"matplotlib", "scipy", "docx", "pandas", "ezdxf"}
+
+@pytest.mark.parametrize("module", ["kernel", "batch"])
+def test_import_time(module):
+    import subprocess
+
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=Path(__file__).parent.parent, capture_output=True, text=True, check=True)
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    imports = {}
+    for line in completed.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            _, cumulative, name = line.split("|")
+            imports[name.strip()] = int(cumulative)
+
+    assert not {name.split(".")[0] for name in imports} & HEAVY_PACKAGES
+    assert imports[module] < KERNEL_IMPORT_BUDGET_US
+
+def test_ground_grid_concurrency(ground_grid_inputs):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    root = Path(__file__).parent.parent
+    drawings = [(str(root / "Fig_B2__mm.dxf"), "mm"), (str(root / "Fig_B3__m.dxf"), "m"),
+                (str(root / "Fig_B4__mm.dxf"), "mm")]
+    scenarios = [dict(ground_grid_inputs, filepath=filepath, fileunits=fileunits, ro=ro, fault_duration=duration)
+                 for filepath, fileunits in drawings for ro in (100, 400, 1000) for duration in (0.3, 0.5, 1.0)]
+    expected = [ground_grid(**scenario, pipeline=GroundGridPipeline()) for scenario in scenarios]
+
+    # Switch threads often so the stages and the geometry steps interleave
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        pipeline = GroundGridPipeline(max_entries=32)
+        jobs = [i % len(scenarios) for i in range(300)]
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(lambda i: ground_grid(**scenarios[i], pipeline=pipeline), jobs))
+
+        # A stage requested by several threads at once is computed by one of them
+        pipeline = GroundGridPipeline()
+        barrier = threading.Barrier(8)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            shared = list(pool.map(lambda _: pipeline.run(lambda name: barrier.wait(), until="geometry",
+                                                          filepath=drawings[0][0], fileunits=drawings[0][1]),
+                                   range(8)))
+
+        # Many threads reading the lazy properties of the same geometries
+        geometries = [Geom_etry(*load_geometry(filepath, fileunits)) for filepath, fileunits in drawings]
+        names = ["max_dist", "shape", "area", "mesh_separation", "location_rods", "max_separation"]
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            values = list(pool.map(lambda i: getattr(geometries[i % 3], names[i % len(names)]), range(180)))
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert results == [expected[i] for i in jobs]
+    assert all(geometry is shared[0] for geometry in shared)
+    fresh = [Geom_etry(*load_geometry(filepath, fileunits)) for filepath, fileunits in drawings]
+    assert values == [getattr(fresh[i % 3], names[i % len(names)]) for i in range(180)]
+
+def test_instrumentation(ground_grid_inputs):
+    # Same module as the kernel, which imports it from the repository root
+    from instrumentation import recording, stage
+
+    # Nothing is recorded without a recorder
+    assert stage("parse") is stage("geometry")
+
+    seen = []
+    with recording(callbacks=[lambda name, category, seconds: seen.append((category, name))]) as recorder:
+        ground_grid(**ground_grid_inputs, pipeline=GroundGridPipeline())
+
+    names = {(event["category"], event["name"]) for event in recorder.events}
+    assert {("kernel", "parse"), ("kernel", "grid"), ("geometry", "polyg_one")} <= names
+    assert set(seen) == names
+    assert all(event["duration_ns"] >= 0 for event in recorder.events)
+
+    summary = recorder.summary()
+    assert summary == sorted(summary, key=lambda row: row["total"], reverse=True)
+    assert "kernel.grid" in recorder.summary_table()
+
+    trace = recorder.to_chrome_trace()["traceEvents"]
+    assert len(trace) == len(recorder.events) and {event["ph"] for event in trace} == {"X"}
+
+@pytest.mark.parametrize("shape", ["rectangle", "L", "T", "irregular"])
+def test_synthetic_drawings(shape, tmp_path):
+    from ..benchmarks.dxf_generator import write_grid_dxf, grid_geometry
+
+    path = str(tmp_path / f"{shape}.dxf")
+    written = write_grid_dxf(path, shape, 6, 6, rod_step=2, rod_density=0.2, noise=1)
+    lines, rods = load_geometry(path, "m", cache=None)
+
+    # The other layers are left out
+    assert len(lines) == written["segments"] and len(rods) == written["rods"] and written["noise"] > 0
+    expected_lines, expected_rods = grid_geometry(shape, 6, 6, rod_step=2, rod_density=0.2)
+    assert np.allclose(np.sort(lines.reshape(-1, 4), axis=0), np.sort(expected_lines.reshape(-1, 4), axis=0))
+
+    geometry = Geom_etry(lines, rods)
+    if shape == "rectangle":
+        assert geometry.shape == "rectangle"
+        assert np.isclose(geometry.area, 42 * 42)
+
+    inputs = dict(filepath=path, fileunits="m", conductor_type="Copper, anealed soft-drawn",
+                  short_circuit_conductor=6.814, short_circuit=3.18, fault_duration=0.5, person_weight=70,
+                  cable_depth=0.5, depth_crushed_rock=0.102, ro=400, ros=2500, ambient_temperature=40,
+                  split_factor=0.6, rod_length=7.5, rod_diameter=0.02, case="Sverak", override_mesh=False,
+                  parallel_separ=8)
+    result = ground_grid(**inputs, pipeline=GroundGridPipeline())
+    assert result.resistance > 0 and result.touch_voltage > 0
+
+def test_ground_grid_progress(ground_grid_inputs):
+    names = []
+    pipeline = GroundGridPipeline()
+    ground_grid(**ground_grid_inputs, pipeline=pipeline, progress=names.append)
+    assert names == [name for name, _ in pipeline.trace]
+
+    # An exception raised by the hook stops the run, the later stages are not memoised
+    def cancel_at_grid(name):
+        if name == "grid":
+            raise KeyboardInterrupt
+    edited = dict(ground_grid_inputs, ro=100)
+    with pytest.raises(KeyboardInterrupt):
+        ground_grid(**edited, pipeline=pipeline, progress=cancel_at_grid)
+    ground_grid(**edited, pipeline=pipeline)
+    assert pipeline.recomputed() == ["grid", "surface", "tolerable", "voltages", "results"]
+
+def test_background_run(ground_grid_inputs):
+    import asyncio
+    from dataclasses import astuple
+    from ..GUI.background import run_ground_grid, stats
+
+    seen = []
+    result = asyncio.run(run_ground_grid(ground_grid_inputs, lambda *update: seen.append(update)))
+    assert astuple(result) == astuple(ground_grid(**ground_grid_inputs))
+    assert [done for done, _, _, _ in seen] == list(range(len(seen)))
+    assert seen[0][2:] == ("parse", "parse") and seen[-1][2:] == ("calc", "results")
+
+    async def concurrent(inputs, cancel_first):
+        # Two identical requests and a different one
+        edited = dict(inputs, ro=123)
+        tasks = [asyncio.create_task(run_ground_grid(values)) for values in (inputs, inputs, edited)]
+        await asyncio.sleep(0)
+        if cancel_first:
+            tasks[0].cancel()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    before = dict(stats)
+    first, second, third = asyncio.run(concurrent(dict(ground_grid_inputs, ro=321), cancel_first=False))
+    assert first is second and astuple(third) != astuple(first)
+    assert stats["computed"] - before["computed"] == 2 and stats["coalesced"] - before["coalesced"] == 1
+
+    # The shared calculation goes on for the request still waiting for it
+    before = dict(stats)
+    first, second, _ = asyncio.run(concurrent(dict(ground_grid_inputs, ro=654), cancel_first=True))
+    assert isinstance(first, asyncio.CancelledError) and astuple(second)[6] > 0
+    assert stats["cancelled"] == before["cancelled"]
+
+    # Without other request, the calculation is dropped
+    async def cancelled(inputs):
+        task = asyncio.create_task(run_ground_grid(inputs))
+        await asyncio.sleep(0)
+        task.cancel()
+        return await asyncio.gather(task, return_exceptions=True)
+
+    before = dict(stats)
+    assert isinstance(asyncio.run(cancelled(dict(ground_grid_inputs, ro=987)))[0], asyncio.CancelledError)
+    assert stats["cancelled"] == before["cancelled"] + 1
+
+def test_upload_cache(ground_grid_inputs, tmp_path):
+    import gc
+    import weakref
+    from shapely.geometry import Polygon
+    from ..GUI.upload_cache import UploadCache, estimate_bytes
+
+    values = np.zeros(1000)
+    assert estimate_bytes([values, values[10:], values]) < 2 * values.nbytes
+    # The elements of an object array, e.g. the polygons of the meshes, are counted
+    polygons = np.empty(2, dtype=object)
+    polygons[:] = [Polygon([(0, 0), (i + 1, 0), (0, 1)]) for i in range(2)]
+    assert estimate_bytes(polygons) >= polygons.nbytes + 2 * 4 * 16
+
+    pipeline = GroundGridPipeline()
+    cache = UploadCache(pipeline=pipeline)
+    filepath = ground_grid_inputs["filepath"]
+    entry = cache.get(filepath, "mm", name="B2")
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert entry.geometry is pipeline.run(until="geometry", filepath=filepath, fileunits="mm")
+    assert len(entry.lines) > 0 and entry.nbytes > 0
+    entry.geometry.compute_all()
+    assert entry.size() > entry.nbytes
+
+    # A copy of the upload has the same content
+    copy = tmp_path / "copy.dxf"
+    copy.write_bytes(Path(filepath).read_bytes())
+    assert cache.get(str(copy), "mm") is entry and cache.hits == 1
+    assert cache.get(filepath, "m") is not entry
+
+    # Over the cap, only the most recently used drawing is kept, and the kernel memo
+    # lets the others go too
+    geometry = weakref.ref(entry.geometry)
+    del entry
+    cache.max_bytes = 1
+    cache.get(str(copy), "in")
+    totals, entries = cache.stats()
+    assert totals["drawings"] == 1 and cache.evictions == 2
+    assert entries[0]["drawing"] == "copy.dxf" and entries[0]["units"] == "in"
+    gc.collect()
+    assert geometry() is None
+    assert pipeline.run(until="parse", filepath=filepath, fileunits="mm") is not None
+    assert pipeline.recomputed() == ["parse"]
+
+def test_prefetch_drawing(ground_grid_inputs):
+    import asyncio
+    from ..GUI.background import prefetch_drawing
+    from kernel import default_pipeline
+
+    filepath = ground_grid_inputs["filepath"]
+    entry = asyncio.run(prefetch_drawing(filepath, "mm", "B2"))
+    assert {"shape", "area", "meshes", "location_rods"} <= set(vars(entry.geometry))
+
+    # The calculation finds the geometry in the memo
+    default_pipeline.run(**ground_grid_inputs)
+    assert not {"parse", "geometry"} & set(default_pipeline.recomputed())
+    assert default_pipeline.run(until="geometry", filepath=filepath, fileunits="mm") is entry.geometry
+
+def test_plot_grid(ground_grid_inputs, monkeypatch):
+    from matplotlib.collections import LineCollection
+    from ..plots import plots
+    from ..plots.plots import plot_grid_with_lines_and_rods, merge_collinear, grid_png, png_cache_info
+
+    # Runs drawn segment by segment, in both directions, overlapping or apart
+    lines = np.array([[[0, 0], [1, 0]], [[2, 0], [1, 0]], [[1.5, 0], [1.8, 0]], [[3, 0], [4, 0]],
+                      [[0, 1], [0, 2]], [[0, 0], [0, 1]], [[0, 0], [1, 1]], [[2, 2], [1, 1]]], dtype=float)
+    merged = merge_collinear(lines)
+    assert sorted(map(tuple, merged.reshape(-1, 4).round(9))) == [
+        (0, 0, 0, 2), (0, 0, 2, 0), (0, 0, 2, 2), (3, 0, 4, 0)]
+
+    # A lattice of unit segments becomes one segment per grid line
+    xs = np.arange(50.0)
+    horizontal = np.array([[[x, y], [x + 1, y]] for y in xs for x in xs[:-1]])
+    lattice = np.concatenate([horizontal, horizontal[:, :, ::-1]])
+    assert len(merge_collinear(lattice)) == 100
+
+    # Float noise in the direction, and vertical runs drawn on both sides of the angle seam
+    noisy = np.array([[[0, 0], [1, 1e-13]], [[1, 1e-13], [2, -1e-13]], [[5, 0], [5 + 1e-13, 1]],
+                      [[5 - 1e-13, 2], [5, 1]]], dtype=float)
+    assert len(merge_collinear(noisy)) == 2
+    assert sorted(map(tuple, merge_collinear(noisy).reshape(-1, 4).round(9))) == [(0, 0, 2, 0), (5, 0, 5, 2)]
+
+    lines_list, rods_list = load_geometry(ground_grid_inputs["filepath"], "mm")
+    fig = plot_grid_with_lines_and_rods(lines=lines_list, rods=rods_list)
+    ax = fig.axes[0]
+    assert [len(c.get_segments()) for c in ax.collections if isinstance(c, LineCollection)] == [len(lines_list)]
+    assert ax.get_legend_handles_labels()[1] == ["Lines", "Rods"]
+    fig = plot_grid_with_lines_and_rods(lines=lattice, rods=rods_list, lod=100)
+    assert [len(c.get_segments()) for c in fig.axes[0].collections if isinstance(c, LineCollection)] == [100]
+    fig = plot_grid_with_lines_and_rods(lines=lattice, rods=rods_list, lod=10)
+    assert len(fig.axes[0].images) == 1
+
+    # The image is rendered once per geometry and size
+    before = png_cache_info()
+    png = grid_png(lines_list, rods_list, 300, 200)
+    assert png.startswith(b"\x89PNG") and grid_png(lines_list.copy(), rods_list, 300, 200) == png
+    after = png_cache_info()
+    assert after["hits"] - before["hits"] == 1 and after["misses"] - before["misses"] == 1
+
+    # Over the cap, only the newest image is kept
+    monkeypatch.setattr(plots, "PNG_CACHE_BYTES", 1)
+    grid_png(lines_list, rods_list, 200, 100)
+    assert png_cache_info()["images"] == 1 and png_cache_info()["max_bytes"] == 1